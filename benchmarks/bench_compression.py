@@ -0,0 +1,70 @@
+"""
+Reports bytes saved against CPU spent for each available response encoding
+and level, on a large storage list page and a large fulfillment plan.
+
+    python benchmarks/bench_compression.py [--rows 1000] [--lines 2000]
+"""
+import argparse
+import json
+import time
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--lines', type=int, default=2000)
+    args = parser.parse_args()
+
+    common.setup()
+    from rest_framework.test import APIClient
+    from api import middleware
+    from api.models import SKU, Storage
+
+    SKU.objects.bulk_create(
+        [SKU(product_name='Product %d' % i) for i in range(100)])
+    skus = list(SKU.objects.all())
+    Storage.objects.bulk_create(
+        [Storage(sku=skus[i % 100], stock=i % 97 + 1)
+         for i in range(args.rows * 5)])
+
+    client = APIClient()
+    bodies = {
+        'storage list': client.get(
+            '/api/storage/', {'page_size': args.rows}).content,
+        'fulfillment': client.post('/api/fulfillment/', {'lines': [
+            {'sku': skus[i % 100].id, 'quantity': 150}
+            for i in range(args.lines)]}, format='json').content,
+    }
+    assert json.loads(bodies['fulfillment'])['success']
+
+    levels = {
+        middleware.GzipEncoder: (1, 4, 6, 9),
+        middleware.BrotliEncoder: (1, 4, 6),
+        middleware.ZstdEncoder: (1, 3, 9),
+    }
+    print("%-13s %-6s %5s %10s %10s %8s %9s %14s" % (
+        'body', 'coding', 'level', 'bytes', 'saved', 'ratio', 'cpu ms',
+        'saved KB/cpu ms'))
+    for name, body in bodies.items():
+        print("%-13s %-6s %5s %10d" % (name, 'none', '-', len(body)))
+        for encoder_class in middleware.ENCODERS:
+            for level in levels[encoder_class]:
+                def compress():
+                    encoder = encoder_class(level)
+                    return encoder.compress(body) + encoder.finish()
+
+                size = len(compress())
+                started = time.process_time()
+                for _ in range(10):
+                    compress()
+                cpu = (time.process_time() - started) / 10 * 1000
+                saved = len(body) - size
+                print("%-13s %-6s %5d %10d %10d %7.1fx %9.2f %14.1f" % (
+                    name, encoder_class.encoding, level, size, saved,
+                    len(body) / size, cpu, saved / 1024 / cpu if cpu else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares list endpoint throughput with the values() fast path against the
+full ModelSerializer path.
+
+    python benchmarks/bench_fast_list.py [--rows 20000] [--page-size 1000]
+"""
+import argparse
+from unittest import mock
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    common.setup()
+    from rest_framework.test import APIClient
+    from api.models import SKU, Storage, Order, OrderLine
+    from api.views import FastListMixin
+
+    SKU.objects.bulk_create(
+        [SKU(product_name='Product %d' % i) for i in range(100)])
+    skus = list(SKU.objects.all())
+    order = Order.objects.create(customer_name='Benchmark')
+    Storage.objects.bulk_create(
+        [Storage(sku=skus[i % 100], stock=i % 97) for i in range(args.rows)])
+    OrderLine.objects.bulk_create(
+        [OrderLine(sku=skus[i % 100], order=order, quantity=i % 13 + 1)
+         for i in range(args.rows)])
+
+    client = APIClient()
+    print("%-20s %12s %12s %8s" % ('endpoint', 'full rows/s', 'fast rows/s',
+                                   'speedup'))
+    for url in ('/api/storage/', '/api/orderline/'):
+        url = '%s?page_size=%d' % (url, args.page_size)
+
+        def fetch():
+            return client.get(url).content
+
+        fast_content = fetch()
+        fast = common.best_of(fetch)
+        with mock.patch.object(FastListMixin, 'fast_list', False):
+            assert fetch() == fast_content, "Responses differ"
+            full = common.best_of(fetch)
+        print("%-20s %12.0f %12.0f %7.1fx" % (
+            url.split('?')[0], args.page_size / full,
+            args.page_size / fast, full / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares payload size and request time of the response formats, with all
+fields and with a sparse fieldset. Sizes are relative to plain JSON with
+all fields.
+
+    python benchmarks/bench_formats.py [--rows 20000] [--page-size 1000]
+"""
+import argparse
+
+import common
+
+FORMATS = (
+    ('json', 'application/json'),
+    ('columnar', 'application/vnd.wms.columnar+json'),
+    ('msgpack', 'application/x-msgpack'),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    common.setup()
+    from rest_framework.test import APIClient
+    from api import renderers
+    from api.models import SKU, Order, OrderLine
+
+    SKU.objects.bulk_create(
+        [SKU(product_name='Product %d' % i) for i in range(100)])
+    skus = list(SKU.objects.all())
+    order = Order.objects.create(customer_name='Benchmark')
+    OrderLine.objects.bulk_create(
+        [OrderLine(sku=skus[i % 100], order=order, quantity=i % 13 + 1)
+         for i in range(args.rows)])
+
+    client = APIClient()
+    print("%-10s %-14s %10s %10s %10s" % (
+        'format', 'fields', 'bytes', 'ms', 'size'))
+    baseline = None
+    for fields in (None, 'id,quantity'):
+        for name, media_type in FORMATS:
+            if name == 'msgpack' and renderers.msgpack is None:
+                continue
+            params = {'page_size': args.page_size}
+            if fields:
+                params['fields'] = fields
+
+            def fetch():
+                return client.get(
+                    '/api/orderline/', params, HTTP_ACCEPT=media_type)
+
+            size = len(fetch().content)
+            elapsed = common.best_of(fetch)
+            baseline = baseline or size
+            print("%-10s %-14s %10d %10.2f %9.0f%%" % (
+                name, fields or 'all', size, elapsed * 1000,
+                100.0 * size / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Load-tests the API over HTTP: serves the app from several local worker
+processes over a seeded throwaway database, drives it with a mix of
+fulfillment, CRUD, search and list requests from concurrent clients at
+increasing concurrency, and records throughput, latency percentiles and
+error rates per step to JSON.
+
+    python benchmarks/bench_load.py [--workers 4] [--concurrency 1,4,16,64]
+        [--duration 10] [--mix fulfil=5,crud=2,search=2,list=1]
+        [--output load_test.json]
+
+Clients are spread over --client-processes processes so the load
+generator isn't held back by a single GIL. Every client sends its own
+X-Client-Id, like distinct callers would.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import common
+
+KINDS = ('fulfil', 'crud', 'search', 'list')
+NAMES = (
+    'Müller', 'Smith', 'García', 'Nguyen', 'Øster', 'Jones', 'Kowalski')
+SEARCHES = ('mul', 'smi', 'gar', 'ngu', 'ost', 'jon', 'kow')
+
+
+def seed(skus, storages_per_sku, orders):
+    """
+    Fills the database with warehouses, SKUs stocked in them and orders.
+    """
+    from api.helpers import convert_to_ascii, search_key
+    from api.models import Order, SKU, Storage, Warehouse
+
+    Warehouse.objects.bulk_create(
+        Warehouse(id=i, name='Warehouse %d' % i) for i in range(1, 4))
+    SKU.objects.bulk_create(
+        SKU(id=i, product_name='Product %d' % i)
+        for i in range(1, skus + 1))
+    Storage.objects.bulk_create(
+        Storage(id=i, sku_id=(i - 1) // storages_per_sku + 1,
+                warehouse_id=i % 3 + 1, aisle=i % 20 + 1, bay=i % 40 + 1,
+                stock=random.randint(10 ** 5, 10 ** 6))
+        for i in range(1, skus * storages_per_sku + 1))
+    names = [
+        '%s %s' % (random.choice(NAMES), i) for i in range(1, orders + 1)]
+    Order.objects.bulk_create(
+        Order(id=i, customer_name=name,
+              customer_name_ascii=convert_to_ascii(name),
+              customer_name_key=search_key(name))
+        for i, name in enumerate(names, 1))
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve(listener):
+    """
+    Serves the app on a socket bound by the parent process, a thread per
+    connection.
+    """
+    from django.core.wsgi import get_wsgi_application
+
+    server = ThreadingWSGIServer(
+        listener.getsockname(), QuietHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener
+    server.server_name, server.server_port = listener.getsockname()[:2]
+    server.setup_environ()
+    server.set_app(get_wsgi_application())
+    server.serve_forever()
+
+
+def request(port, client, kind, skus, storages):
+    """
+    Sends one request of a kind and returns its status (0 if the
+    connection failed).
+    """
+    headers = {'X-Client-Id': client, 'Content-Type': 'application/json'}
+    body = None
+    if kind == 'fulfil':
+        method, url = 'POST', '/api/fulfillment/'
+        lines = random.sample(range(1, skus + 1), random.randint(1, 5))
+        body = {
+            'lines': [
+                {'sku': sku, 'quantity': random.randint(1, 5)}
+                for sku in lines],
+            'warehouse': random.randint(1, 3)}
+    elif kind == 'crud':
+        storage = random.randint(1, storages)
+        method, url, body = random.choice((
+            ('GET', '/api/storage/%d/' % storage, None),
+            ('PATCH', '/api/storage/%d/' % storage,
+             {'stock': random.randint(10 ** 5, 10 ** 6)}),
+            ('POST', '/api/order/', {'customer_name': random.choice(NAMES)}),
+        ))
+    elif kind == 'search':
+        method, url = 'GET', '/api/order/?fold=true&q=%s' % random.choice(
+            SEARCHES)
+    else:
+        method, url = 'GET', '/api/storage/?page_size=100&page=%d' % (
+            random.randint(1, max(storages // 100, 1)))
+
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request(
+            method, url, body=json.dumps(body) if body is not None else None,
+            headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    except (OSError, http.client.HTTPException):
+        return 0
+    finally:
+        connection.close()
+
+
+def run_clients(args):
+    """
+    Runs `clients` client threads until `deadline` and returns the
+    (kind, status, seconds) of the requests they started after `measured`.
+    """
+    (port, first_client, clients, measured, deadline, mix, skus, storages,
+     seed_value) = args
+    random.seed(seed_value)
+    kinds = [kind for kind, weight in mix for _ in range(weight)]
+    samples = []
+    lock = threading.Lock()
+
+    def client(number):
+        while True:
+            started = time.monotonic()
+            if started >= deadline:
+                return
+            kind = random.choice(kinds)
+            status = request(port, 'load-%d' % number, kind, skus, storages)
+            if started >= measured:
+                with lock:
+                    samples.append(
+                        (kind, status, time.monotonic() - started))
+
+    threads = [
+        threading.Thread(target=client, args=(first_client + i,))
+        for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(samples, seconds):
+    """
+    Returns throughput, error rate, status counts and latency percentiles
+    in milliseconds of (kind, status, seconds) samples.
+    """
+    latencies = sorted(latency * 1000 for _, _, latency in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(1 for _, status, _ in samples if status == 0 or
+                 status >= 500 or status == 429)
+    summary = {
+        'requests': len(samples),
+        'throughput': len(samples) / seconds,
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'statuses': statuses,
+    }
+    if latencies:
+        summary['latency_ms'] = {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--client-processes', type=int, default=2)
+    parser.add_argument('--concurrency', default='1,4,16,64')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--mix', default='fulfil=5,crud=2,search=2,list=1')
+    parser.add_argument('--skus', type=int, default=1000)
+    parser.add_argument('--storages-per-sku', type=int, default=4)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='load_test.json')
+    args = parser.parse_args()
+
+    mix = []
+    for item in args.mix.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in KINDS:
+            parser.error("Unknown request kind %s, expected one of %s." % (
+                kind, ', '.join(KINDS)))
+        mix.append((kind, int(weight or 1)))
+
+    # Workers are separate processes, so the throwaway database is a file
+    directory = tempfile.TemporaryDirectory()
+    common.setup(database=os.path.join(directory.name, 'load_test.sqlite3'))
+    from django.db import connections
+
+    random.seed(args.seed)
+    seed(args.skus, args.storages_per_sku, args.orders)
+    storages = args.skus * args.storages_per_sku
+    connections.close_all()
+
+    context = multiprocessing.get_context('fork')
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    port = listener.getsockname()[1]
+    workers = [
+        context.Process(target=serve, args=(listener,), daemon=True)
+        for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    results = {'config': vars(args), 'steps': []}
+    print("%11s %9s %9s %8s %8s %8s %8s" % (
+        'concurrency', 'req/s', 'errors', 'p50 ms', 'p90 ms', 'p99 ms',
+        'max ms'))
+    try:
+        with context.Pool(args.client_processes) as pool:
+            for concurrency in map(int, args.concurrency.split(',')):
+                started = time.monotonic()
+                measured = started + args.warmup
+                deadline = measured + args.duration
+                shares = [
+                    concurrency // args.client_processes +
+                    (i < concurrency % args.client_processes)
+                    for i in range(args.client_processes)]
+                batches = pool.map(run_clients, [
+                    (port, sum(shares[:i]), share, measured, deadline, mix,
+                     args.skus, storages,
+                     '%d-%d-%d' % (args.seed, concurrency, i))
+                    for i, share in enumerate(shares) if share])
+                samples = [sample for batch in batches for sample in batch]
+
+                step = summarize(samples, args.duration)
+                step['concurrency'] = concurrency
+                step['kinds'] = {
+                    kind: summarize(
+                        [s for s in samples if s[0] == kind], args.duration)
+                    for kind, _ in mix}
+                results['steps'].append(step)
+                latency = step.get('latency_ms', {})
+                print("%11d %9.1f %8.1f%% %8.1f %8.1f %8.1f %8.1f" % (
+                    concurrency, step['throughput'],
+                    step['error_rate'] * 100, latency.get('p50', 0),
+                    latency.get('p90', 0), latency.get('p99', 0),
+                    latency.get('max', 0)))
+    finally:
+        for worker in workers:
+            worker.terminate()
+        directory.cleanup()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
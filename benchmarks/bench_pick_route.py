@@ -0,0 +1,60 @@
+"""
+Compares the walking distance and compute time of pick routes: picks in
+plan order, S-shape, and nearest neighbour + 2-opt, on random plans in a
+zone of 20 aisles of 40 bays.
+
+    python benchmarks/bench_pick_route.py [--sizes 10,50,200,500]
+"""
+import argparse
+import random
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,50,200,500')
+    parser.add_argument('--aisles', type=int, default=20)
+    parser.add_argument('--bays', type=int, default=40)
+    args = parser.parse_args()
+
+    common.setup()
+    from django.test import override_settings
+    from api import routing
+
+    random.seed(42)
+    print("%6s %-10s %10s %10s %9s" % (
+        'picks', 'route', 'length', 'vs plan', 'ms'))
+    for size in map(int, args.sizes.split(',')):
+        picks = [{'id': i, 'quantity': 1} for i in range(size)]
+        locations = {
+            i: ('', random.randint(1, args.aisles),
+                random.randint(1, args.bays), random.randint(0, 4))
+            for i in range(size)}
+
+        # Plan order: the route walked without sequencing
+        stops = [(min(loc[1] for loc in locations.values()), 0, 0)] + [
+            locations[pick['id']][1:] for pick in picks]
+        stops = [(aisle, bay, level or 0) for aisle, bay, level in stops]
+        layout = routing.Layout(
+            stops, routing.route_settings()['AISLE_WIDTH'],
+            routing.route_settings()['BAY_WIDTH'])
+        plan_length = routing.path_length(
+            list(range(size + 1)), layout.matrix(stops))
+        print("%6d %-10s %10.0f %9.0f%% %9s" % (
+            size, 'plan', plan_length, 100, '-'))
+
+        for name, minimum in (
+                (routing.S_SHAPE, 10 ** 9), (routing.OPTIMIZED, 0)):
+            with override_settings(PICK_ROUTE={'OPTIMIZE_MIN_PICKS': minimum}):
+                _, _, length = routing.sequence_picks(picks, locations)
+                seconds = common.best_of(
+                    lambda: routing.sequence_picks(picks, locations),
+                    repeat=3)
+            print("%6d %-10s %10.0f %9.0f%% %9.2f" % (
+                size, name, length, 100 * length / plan_length,
+                seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares settings profiles on cold-start time in a fresh interpreter
+(setting up the apps, then loading the handler and serving a first
+request) and on per-request overhead of the handler and middleware stack.
+
+    python benchmarks/bench_startup.py [--runs 10] [--requests 2000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+PROFILES = ('wms.settings', 'wms.settings_lean')
+
+STARTUP = """
+import sys, time
+started = time.perf_counter()
+sys.path.insert(0, %(path)r)
+import django
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import Client
+imported = time.perf_counter()
+django.setup(set_prefix=False)
+setup = time.perf_counter()
+WSGIHandler()
+Client().get('/api/metrics/')
+finished = time.perf_counter()
+print(setup - imported, finished - setup, finished - started)
+"""
+
+
+def startup_time(profile, runs):
+    """
+    Returns the best seconds, over fresh interpreters, to set up the apps
+    (django.setup()), to load the handler and serve a first request, and
+    for both including importing Django itself.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+    code = STARTUP % {'path': os.path.join(common.ROOT, 'wms')}
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=env)
+        times.append([float(v) for v in output.split()])
+    return [min(column) for column in zip(*times)]
+
+
+def request_overhead(profile, requests):
+    """
+    Returns the mean microseconds per request through the full handler and
+    middleware stack, and calling the view directly, in a child process.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--child', '--requests', str(requests)],
+        env=env)
+    return [float(v) for v in output.split()]
+
+
+def child(requests):
+    import django
+    django.setup()
+    from django.test import Client, RequestFactory
+    from django.test.utils import setup_test_environment
+    from api.views import metrics
+
+    setup_test_environment()
+    client = Client()
+    factory = RequestFactory()
+    for _ in range(100):
+        client.get('/api/metrics/')
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get('/api/metrics/')
+    full = (time.perf_counter() - started) / requests
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        metrics(factory.get('/api/metrics/'))
+    view = (time.perf_counter() - started) / requests
+    print(full * 1e6, view * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--child', action='store_true')
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.requests)
+
+    print("%-18s %9s %13s %9s %11s %9s %11s" % (
+        'profile', 'setup ms', 'first req ms', 'total ms', 'request us',
+        'view us', 'overhead us'))
+    for profile in PROFILES:
+        setup, first_request, total = startup_time(profile, args.runs)
+        full, view = request_overhead(profile, args.requests)
+        print("%-18s %9.1f %13.1f %9.1f %11.1f %9.1f %11.1f" % (
+            profile, setup * 1000, first_request * 1000, total * 1000,
+            full, view, full - view))
+
+
+if __name__ == '__main__':
+    main()
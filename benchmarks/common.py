@@ -0,0 +1,40 @@
+"""
+Shared setup for the benchmarks: configures Django against a throwaway
+test database, so benchmarks never touch db.sqlite3.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'wms'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wms.settings')
+
+
+def setup(database=None):
+    """
+    Sets up Django and creates the test database, in the SQLite file
+    `database` if given so that other processes can open it too.
+    """
+    import django
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+    if database is not None:
+        connection.settings_dict['TEST']['NAME'] = database
+    connection.creation.create_test_db(verbosity=0)
+
+
+def best_of(function, repeat=5, number=1):
+    """
+    Returns the best time in seconds of `number` calls to `function`.
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append(time.perf_counter() - started)
+    return min(times) / number
@@ -0,0 +1,185 @@
+from collections import OrderedDict, deque
+import functools
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .helpers import client_id, error_response
+
+
+ADMITTED = 'admitted'
+QUEUE_FULL = 'queue_full'
+CLIENT_LIMIT = 'client_limit'
+TIMED_OUT = 'timed_out'
+
+
+class AdmissionController(object):
+    """
+    Limits the number of requests a worker process runs concurrently.
+
+    Requests beyond `max_concurrent` wait in a bounded queue for at most
+    `max_wait` seconds. Waiting requests are admitted round-robin across
+    clients, and each client may only hold `max_queue_per_client` places in
+    the queue, so a single busy client can't starve the others.
+    """
+
+    def __init__(self, max_concurrent, max_queue, max_queue_per_client,
+                 max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        # Waiters per client, in round-robin order
+        self.queues = OrderedDict()
+        self.counters = {
+            ADMITTED: 0, QUEUE_FULL: 0, CLIENT_LIMIT: 0, TIMED_OUT: 0}
+
+    def acquire(self, client):
+        """
+        Waits for a slot and returns ADMITTED, or the reason the request
+        was rejected. Admitted requests must call `release()`.
+        """
+        with self.lock:
+            if self.in_flight < self.max_concurrent and not self.queued:
+                self.in_flight += 1
+                self.counters[ADMITTED] += 1
+                return ADMITTED
+            if self.queued >= self.max_queue:
+                self.counters[QUEUE_FULL] += 1
+                return QUEUE_FULL
+            queue = self.queues.get(client, ())
+            if len(queue) >= self.max_queue_per_client:
+                self.counters[CLIENT_LIMIT] += 1
+                return CLIENT_LIMIT
+            waiter = threading.Event()
+            self.queues.setdefault(client, deque()).append(waiter)
+            self.queued += 1
+
+        waiter.wait(self.max_wait)
+
+        with self.lock:
+            # A slot may have been granted after the wait timed out
+            if waiter.is_set():
+                self.counters[ADMITTED] += 1
+                return ADMITTED
+            queue = self.queues[client]
+            queue.remove(waiter)
+            if not queue:
+                del self.queues[client]
+            self.queued -= 1
+            self.counters[TIMED_OUT] += 1
+            return TIMED_OUT
+
+    def release(self):
+        """
+        Frees a slot and hands it to the next waiting client.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            while self.in_flight < self.max_concurrent and self.queues:
+                client, queue = next(iter(self.queues.items()))
+                waiter = queue.popleft()
+                if queue:
+                    self.queues.move_to_end(client)
+                else:
+                    del self.queues[client]
+                self.queued -= 1
+                self.in_flight += 1
+                waiter.set()
+
+    def stats(self):
+        """
+        Returns the current queue depth, concurrency and outcome counts.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update({
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+            })
+            return stats
+
+
+def admission_settings():
+    """
+    Returns the FULFILLMENT_ADMISSION settings, or None if admission
+    control is off (the setting is None).
+    """
+    config = {
+        'MAX_CONCURRENT': 4,
+        'MAX_QUEUE': 16,
+        'MAX_QUEUE_PER_CLIENT': 4,
+        'MAX_WAIT': 2.0,
+        'RETRY_AFTER': 1,
+    }
+    overrides = getattr(settings, 'FULFILLMENT_ADMISSION', {})
+    if overrides is None:
+        return None
+    config.update(overrides)
+    return config
+
+
+_controller = None
+
+
+def get_controller():
+    """
+    Returns the fulfillment admission controller configured by the
+    FULFILLMENT_ADMISSION setting, or None if admission control is off.
+    """
+    global _controller
+    config = admission_settings()
+    if config is None:
+        return None
+    if _controller is None:
+        _controller = AdmissionController(
+            max_concurrent=config['MAX_CONCURRENT'],
+            max_queue=config['MAX_QUEUE'],
+            max_queue_per_client=config['MAX_QUEUE_PER_CLIENT'],
+            max_wait=config['MAX_WAIT'])
+    return _controller
+
+
+@receiver(setting_changed)
+def reset_controller(**kwargs):
+    global _controller
+    if kwargs['setting'] == 'FULFILLMENT_ADMISSION':
+        _controller = None
+
+
+def admission_controlled(view):
+    """
+    Runs a view under the fulfillment admission controller, answering with
+    a 429 (client over its queue share) or 503 (queue full or wait timed
+    out) and a Retry-After header when a request isn't admitted.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        controller = get_controller()
+        if controller is None:
+            return view(request, *args, **kwargs)
+
+        outcome = controller.acquire(client_id(request))
+        if outcome == CLIENT_LIMIT:
+            response = error_response(
+                429, 12, "Too many concurrent requests from this client.")
+        elif outcome != ADMITTED:
+            response = error_response(
+                503, 13, "Server is busy, please retry later.")
+        else:
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                controller.release()
+
+        response['Retry-After'] = str(admission_settings()['RETRY_AFTER'])
+        return response
+    return wrapper
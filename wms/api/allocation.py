@@ -0,0 +1,94 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def numpy_available():
+    """
+    Returns true if NumPy is installed and the vectorized engine can be used.
+    """
+    return np is not None
+
+
+class StockSnapshot(object):
+    """
+    Read-only view of storage stock held as NumPy arrays sorted by
+    (sku, stock, id), so that each SKU's storages form one contiguous,
+    least-stock-first segment.
+    """
+
+    def __init__(self, skus, ids, stocks):
+        self.skus = np.asarray(skus, dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.stocks = np.asarray(stocks, dtype=np.int64)
+        # Running total of stock with a leading zero, so that the stock held
+        # before index i is cumulative[i] and segment sums are differences.
+        self.cumulative = np.concatenate(
+            ([0], np.cumsum(self.stocks, dtype=np.int64)))
+
+    def allocate(self, line_skus, line_quantities):
+        """
+        Allocates every (sku, quantity) line independently against the
+        snapshot, least stock first.
+
+        Returns a tuple (feasible, counts, ids, quantities): a boolean array
+        per line, the number of picks per line and the flat storage ids and
+        pick quantities of all feasible lines in line order.
+        """
+        line_skus = np.asarray(line_skus, dtype=np.int64)
+        line_quantities = np.asarray(line_quantities, dtype=np.int64)
+
+        # Segment of each line's SKU in the sorted arrays
+        start = np.searchsorted(self.skus, line_skus, side='left')
+        end = np.searchsorted(self.skus, line_skus, side='right')
+
+        # Index of the storage that completes each line: the first one whose
+        # running total reaches the stock before the segment plus the
+        # quantity. Stock is positive, so running totals strictly increase.
+        target = self.cumulative[start] + line_quantities
+        last = np.searchsorted(self.cumulative[1:], target, side='left')
+        last = np.maximum(last, start)
+
+        empty = start == end
+        feasible = (last < end) | (empty & (line_quantities == 0))
+        counts = np.where(feasible & ~empty, last - start + 1, 0)
+
+        total = int(counts.sum())
+        offsets = np.cumsum(counts) - counts
+        index = np.repeat(start, counts) + (
+            np.arange(total) - np.repeat(offsets, counts))
+
+        ids = self.ids[index]
+        quantities = self.stocks[index]
+        # The last pick of each line only takes what is still outstanding
+        picked = counts > 0
+        quantities[(offsets + counts - 1)[picked]] = (
+            target - self.cumulative[last])[picked]
+
+        return feasible, counts, ids, quantities
+
+    def available(self, sku_id):
+        """
+        Returns the total stock of an SKU.
+        """
+        start = np.searchsorted(self.skus, sku_id, side='left')
+        end = np.searchsorted(self.skus, sku_id, side='right')
+        return int(self.cumulative[end] - self.cumulative[start])
+
+    def allocate_lines(self, line_skus, line_quantities):
+        """
+        Like `allocate()`, but returns a list of booleans and a list of
+        picks per line.
+        """
+        feasible, counts, ids, quantities = self.allocate(
+            line_skus, line_quantities)
+        picks = []
+        position = 0
+        for count in counts.tolist():
+            picks.append([
+                {'id': i, 'quantity': q} for i, q in zip(
+                    ids[position:position + count].tolist(),
+                    quantities[position:position + count].tolist())])
+            position += count
+        return feasible.tolist(), picks
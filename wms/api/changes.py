@@ -0,0 +1,178 @@
+from collections import deque
+import itertools
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SKU, Storage, Order, OrderLine, Tombstone, Warehouse, \
+    bulk_soft_deleted
+from .serializers import SKUSerializer, StorageSerializer, ValuesSerializer
+
+
+class ChangeFeed(object):
+    """
+    In-process fan-out buffer of model changes.
+
+    Every change gets the next sequence number and is kept in a ring buffer
+    of the last `size` changes. Readers wait for changes after a cursor
+    `<epoch>-<seq>`; the epoch identifies this buffer, so cursors from
+    another process or from before a restart are detected. A cursor that
+    is older than the buffer can't be resumed without a gap, and readers
+    must then resync.
+    """
+
+    def __init__(self, size):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.events = deque(maxlen=size)
+        self.condition = threading.Condition()
+
+    def cursor(self, seq=None):
+        return '%s-%d' % (self.epoch, self.seq if seq is None else seq)
+
+    def publish(self, event):
+        with self.condition:
+            self.seq += 1
+            self.events.append(dict(event, seq=self.seq))
+            self.condition.notify_all()
+
+    def parse_cursor(self, cursor):
+        """
+        Returns the sequence number of a cursor of this feed, or None if
+        the cursor can't be resumed.
+        """
+        epoch, _, seq = cursor.rpartition('-')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        seq = int(seq)
+        oldest = self.events[0]['seq'] if self.events else self.seq + 1
+        if seq < oldest - 1:
+            return None
+        return seq
+
+    def read(self, cursor, timeout):
+        """
+        Waits up to `timeout` seconds for changes after `cursor` (None for
+        "from now on"). Returns (events, cursor, reset): `reset` is true if
+        the cursor couldn't be resumed, in which case reading restarts at
+        the current position.
+        """
+        with self.condition:
+            reset = False
+            if cursor is None:
+                seq = self.seq
+            else:
+                seq = self.parse_cursor(cursor)
+                if seq is None:
+                    reset = True
+                    seq = self.seq
+            if not reset:
+                self.condition.wait_for(lambda: self.seq > seq, timeout)
+            # Sequence numbers in the buffer are contiguous
+            start = seq + 1 - self.events[0]['seq'] if self.events else 0
+            events = list(itertools.islice(self.events, max(start, 0), None))
+            return events, self.cursor(), reset
+
+
+def change_feed_settings():
+    config = {
+        'BUFFER_SIZE': 10000,
+        'HEARTBEAT': 15,
+        'MAX_STREAM_SECONDS': 300,
+        'MAX_WAIT': 30,
+    }
+    config.update(getattr(settings, 'CHANGE_FEED', {}))
+    return config
+
+
+feed = ChangeFeed(change_feed_settings()['BUFFER_SIZE'])
+
+
+# Models published to the feed, with the serializer used for their data
+FEED_MODELS = {
+    SKU: ('sku', ValuesSerializer(SKUSerializer)),
+    Storage: ('storage', ValuesSerializer(StorageSerializer)),
+}
+
+
+def publish_change(instance, action):
+    name, serializer = FEED_MODELS[type(instance)]
+    event = {
+        'model': name,
+        'action': action,
+        'id': instance.pk,
+        'data': serializer.to_dict(instance) if action == 'saved' else None,
+    }
+    # Only publish changes that are committed
+    transaction.on_commit(lambda: feed.publish(event))
+
+
+def soft_deleted(instance, update_fields):
+    """
+    Returns true if a save is the soft deletion of the instance.
+    """
+    return instance.deleted_at is not None and (
+        update_fields is None or 'deleted_at' in update_fields)
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_save, sender=Storage)
+def publish_saved(sender, instance, update_fields=None, **kwargs):
+    if instance.deleted_at is None:
+        publish_change(instance, 'saved')
+    elif soft_deleted(instance, update_fields):
+        publish_change(instance, 'deleted')
+
+
+@receiver(post_delete, sender=SKU)
+@receiver(post_delete, sender=Storage)
+def publish_deleted(sender, instance, **kwargs):
+    # Purged rows were published when they were soft-deleted
+    if instance.deleted_at is None:
+        publish_change(instance, 'deleted')
+
+
+def record_tombstone(instance):
+    """
+    Records a deletion for delta syncs, in the deleting transaction.
+    """
+    Tombstone.objects.create(
+        model=instance._meta.model_name, object_id=instance.pk)
+
+
+@receiver(post_delete, sender=SKU)
+@receiver(post_delete, sender=Storage)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=OrderLine)
+@receiver(post_delete, sender=Warehouse)
+def record_delete(sender, instance, **kwargs):
+    # Purged rows were recorded when they were soft-deleted
+    if instance.deleted_at is None:
+        record_tombstone(instance)
+
+
+@receiver(post_save, sender=SKU)
+@receiver(post_save, sender=Storage)
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=OrderLine)
+@receiver(post_save, sender=Warehouse)
+def record_soft_delete(sender, instance, update_fields=None, **kwargs):
+    if soft_deleted(instance, update_fields):
+        record_tombstone(instance)
+
+
+@receiver(bulk_soft_deleted)
+def record_bulk_soft_delete(sender, ids, **kwargs):
+    """
+    Records and publishes rows soft-deleted in one update, like
+    `record_soft_delete()` and `publish_saved()` do for single rows.
+    """
+    Tombstone.objects.bulk_create(
+        Tombstone(model=sender._meta.model_name, object_id=pk) for pk in ids)
+    if sender in FEED_MODELS:
+        for pk in ids:
+            publish_change(sender(pk=pk), 'deleted')
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+import functools
+import itertools
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .helpers import client_id
+
+
+# Routing state of the request handled by this thread: whether reads may go
+# to a replica and whether the request wrote
+_state = threading.local()
+
+_replica_cycle = None
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def choose_replica():
+    """
+    Returns the next replica alias, round-robin.
+    """
+    global _replica_cycle
+    aliases = tuple(replicas())
+    if _replica_cycle is None or _replica_cycle[0] != aliases:
+        _replica_cycle = (aliases, itertools.cycle(aliases))
+    return next(_replica_cycle[1])
+
+
+def pin_key(client):
+    return 'api:db_router:pin:%s' % client
+
+
+def recently_wrote(client):
+    """
+    Returns true if the client wrote within READ_YOUR_WRITES_SECONDS, so
+    its reads must see the primary.
+    """
+    return cache.get(pin_key(client)) is not None
+
+
+@contextmanager
+def replica_reads(request):
+    """
+    Sends reads inside the block to a replica, unless the request's client
+    wrote recently.
+    """
+    previous = getattr(_state, 'replica', False)
+    _state.replica = bool(replicas()) and not recently_wrote(
+        client_id(request))
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def reads_from_replica(view):
+    """
+    Decorates a function view whose reads may be served by a replica.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(request):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaReadMixin(object):
+    """
+    Serves the list and retrieve actions of a viewset from a replica.
+    """
+
+    def list(self, request, *args, **kwargs):
+        with replica_reads(request):
+            return super(ReplicaReadMixin, self).list(
+                request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        with replica_reads(request):
+            return super(ReplicaReadMixin, self).retrieve(
+                request, *args, **kwargs)
+
+
+class ReplicaRouter(object):
+    """
+    Routes writes to the primary (`default`) and reads to a replica when
+    inside `replica_reads()`. Writes pin the client making the request to
+    the primary for READ_YOUR_WRITES_SECONDS, through the cache, so that it
+    reads its own writes even if replicas lag.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replica', False):
+            return choose_replica()
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # All aliases hold the same data
+        return True
+
+
+def reset_writes():
+    """
+    Starts tracking writes for a new request.
+    """
+    _state.wrote = False
+
+
+@contextmanager
+def untracked_writes():
+    """
+    Writes inside the block don't count as the request's writes, for
+    bookkeeping that clients never read back.
+    """
+    wrote = getattr(_state, 'wrote', False)
+    try:
+        yield
+    finally:
+        _state.wrote = wrote
+
+
+def pin_if_wrote(request):
+    """
+    Pins the request's client to the primary if the request wrote.
+    """
+    if getattr(_state, 'wrote', False) and replicas():
+        cache.set(
+            pin_key(client_id(request)), True,
+            getattr(settings, 'READ_YOUR_WRITES_SECONDS', 5))
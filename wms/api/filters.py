@@ -0,0 +1,53 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+
+class QueryParamFilterBackend(BaseFilterBackend):
+    """
+    Filters a queryset by the lookups a view lists in `filter_fields`,
+    taken from query parameters of the same name (e.g. `sku`, `sku__in`,
+    `stock__gte`). Values must be positive integers; `__in` lookups take a
+    comma separated list.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filters = {}
+        errors = {}
+        for lookup in getattr(view, 'filter_fields', ()):
+            value = request.query_params.get(lookup, None)
+            if value is None:
+                continue
+            try:
+                if lookup.endswith('__in'):
+                    filters[lookup] = [
+                        self.parse(v) for v in value.split(',') if v]
+                else:
+                    filters[lookup] = self.parse(value)
+            except ValueError:
+                errors[lookup] = [
+                    "Must be a positive int%s. %s found." % (
+                        " list" if lookup.endswith('__in') else "", value)]
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**filters) if filters else queryset
+
+    @staticmethod
+    def parse(value):
+        value = int(value)
+        if value < 0:
+            raise ValueError(value)
+        return value
+
+
+class StableOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that always sorts by `id` last, so that pages over rows
+    with equal sort keys are stable.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super(StableOrderingFilter, self).get_ordering(
+            request, queryset, view)
+        if ordering and not {'id', '-id'} & set(ordering):
+            ordering = list(ordering) + ['id']
+        return ordering
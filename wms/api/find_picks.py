@@ -1,27 +1,226 @@
+from itertools import groupby
+
 from .models import Storage
+from . import allocation, snapshot
 
 
-def find_picks(order_lines):
+def find_picks(order_lines, warehouse=None, partial=False):
     """
     Finds picks for order lines using Storages with least stock first.
+
+    Lines are planned inside the preferred `warehouse` if it can fulfil the
+    whole order, and otherwise across warehouses with as few splits as
+    possible (see `find_picks_batch()`). Uses the vectorized NumPy engine
+    when NumPy is installed and pure Python otherwise.
     """
-    picks = []
+    return find_picks_batch([order_lines], warehouse, partial)[0]
 
-    for r in order_lines:
-        storages = Storage.objects.filter(
-            sku__id=r['sku'], stock__gt=0).order_by('stock')
-        remaining_quantity = int(r['quantity'])
-        for s in storages:
-            if s.stock >= remaining_quantity:
-                picks.append({'id': s.id, 'quantity': remaining_quantity})
-                remaining_quantity = 0
-                break
-            else:
-                picks.append({'id': s.id, 'quantity': s.stock})
-                remaining_quantity -= s.stock
-            if remaining_quantity == 0:
+
+def find_picks_batch(orders, warehouse=None, partial=False):
+    """
+    Finds picks for a list of orders, each a list of order lines.
+    Returns a list of (success, picks) tuples, one per order.
+
+    With `partial`, lines that can't be fulfilled in full take all the
+    stock there is instead, and (complete, picks, lines) tuples are
+    returned, where `lines` has the quantity picked and backordered of
+    every line.
+
+    Every line is picked from a single warehouse when one holds enough
+    stock. Orders that the preferred warehouse can't fulfil on their own
+    are planned against all warehouses: warehouses that fulfil the most
+    remaining lines are used first, and only lines that no warehouse holds
+    enough stock for are split, across the warehouses with most stock.
+    Storages without a warehouse count as one more warehouse.
+    """
+    line_skus = []
+    line_quantities = []
+    for order_lines in orders:
+        for r in order_lines:
+            line_skus.append(int(r['sku']))
+            line_quantities.append(int(r['quantity']))
+
+    # Line ranges of the orders in the flat line lists
+    ranges = []
+    for order_lines in orders:
+        start = ranges[-1][1] if ranges else 0
+        ranges.append((start, start + len(order_lines)))
+
+    results = [None] * len(orders)
+    pending = list(range(len(orders)))
+
+    if warehouse is not None:
+        # The preferred warehouse alone only reads that site's storages
+        stock = load_stock(line_skus, warehouse)
+        if warehouse in stock:
+            feasible, picks = stock[warehouse].allocate_lines(
+                line_skus, line_quantities)
+            for order in list(pending):
+                start, end = ranges[order]
+                if all(feasible[start:end]):
+                    results[order] = order_result(
+                        range(start, end), line_skus, line_quantities,
+                        picks, {}, partial)
+                    pending.remove(order)
+
+    if pending:
+        skus = [
+            line_skus[line] for order in pending
+            for line in range(*ranges[order])]
+        stock = load_stock(skus)
+        plans = {
+            site: site_stock.allocate_lines(line_skus, line_quantities)
+            for site, site_stock in stock.items()}
+        # Ties go to the preferred warehouse, then to the lowest id
+        sites = sorted(plans, key=lambda site: (
+            site != warehouse, site is None, site or 0))
+        for order in pending:
+            lines = range(*ranges[order])
+            line_picks, shortfalls = plan_across_warehouses(
+                lines, line_skus, line_quantities, stock, plans, sites)
+            results[order] = order_result(
+                lines, line_skus, line_quantities, line_picks, shortfalls,
+                partial)
+
+    return results
+
+
+def order_result(lines, line_skus, line_quantities, line_picks, shortfalls,
+                 partial):
+    """
+    Returns the result tuple of an order from the picks and shortfalls of
+    its lines.
+    """
+    picks = [pick for line in lines for pick in line_picks[line]]
+    if not partial:
+        return (False, []) if shortfalls else (True, picks)
+    return not shortfalls, picks, [{
+        'sku': line_skus[line],
+        'quantity': line_quantities[line],
+        'picked': line_quantities[line] - shortfalls.get(line, 0),
+        'backordered': shortfalls.get(line, 0),
+    } for line in lines]
+
+
+def plan_across_warehouses(lines, line_skus, line_quantities, stock, plans,
+                           sites):
+    """
+    Plans the lines of one order across warehouses, given the plan of
+    every line in every warehouse. Returns the picks of every line, and the
+    quantity short of every line that can't be fulfilled in full, which
+    takes all the stock there is instead.
+    """
+    shortfalls = {}
+    line_picks = {}
+    remaining = list(lines)
+
+    # Greedy set cover: fewest warehouses for the lines that don't need
+    # splitting
+    while remaining:
+        best, covered = None, []
+        for site in sites:
+            feasible = plans[site][0]
+            site_lines = [line for line in remaining if feasible[line]]
+            if len(site_lines) > len(covered):
+                best, covered = site, site_lines
+        if not covered:
+            break
+        for line in covered:
+            line_picks[line] = plans[best][1][line]
+        remaining = [line for line in remaining if line not in line_picks]
+
+    for line in remaining:
+        sku, quantity = line_skus[line], line_quantities[line]
+        available = sorted(
+            ((stock[site].available(sku), site) for site in sites),
+            key=lambda item: -item[0])
+        total = sum(amount for amount, _ in available)
+        if total < quantity:
+            shortfalls[line] = quantity - total
+            quantity = total
+        picks = []
+        for amount, site in available:
+            if not quantity:
                 break
-        if remaining_quantity > 0:
-            return False, []
+            take = min(amount, quantity)
+            picks.extend(stock[site].allocate_lines([sku], [take])[1][0])
+            quantity -= take
+        line_picks[line] = picks
+
+    return line_picks, shortfalls
+
+
+def load_stock(sku_ids, warehouse=None):
+    """
+    Loads the storages with stock for the given SKUs in a single query,
+    grouped by warehouse, optionally in a single warehouse only.
+
+    Reads the shared stock snapshot instead when there is one.
+
+    Returns a dict of warehouse ids (None for storages without one) to
+    StockSnapshots, or to PythonStocks when NumPy isn't installed.
+    """
+    shared = snapshot.get_snapshot()
+    if shared is not None:
+        rows = shared.stock_rows(sku_ids, warehouse)
+    else:
+        rows = Storage.objects.filter(sku_id__in=set(sku_ids), stock__gt=0)
+        if warehouse is not None:
+            rows = rows.filter(warehouse_id=warehouse)
+        rows = rows.order_by(
+            'warehouse_id', 'sku_id', 'stock', 'id').values_list(
+                'warehouse_id', 'sku_id', 'id', 'stock')
+
+    stock = {}
+    for site, site_rows in groupby(rows, key=lambda row: row[0]):
+        _, skus, ids, stocks = zip(*site_rows)
+        if allocation.numpy_available():
+            stock[site] = allocation.StockSnapshot(skus, ids, stocks)
+        else:
+            stock[site] = PythonStock(skus, ids, stocks)
+    return stock
+
 
+class PythonStock(object):
+    """
+    Pure-Python counterpart of StockSnapshot: the storages of each SKU,
+    least stock first.
+    """
+
+    def __init__(self, skus, ids, stocks):
+        self.storages = {}
+        for sku, storage_id, stock in zip(skus, ids, stocks):
+            self.storages.setdefault(sku, []).append((storage_id, stock))
+
+    def available(self, sku_id):
+        return sum(stock for _, stock in self.storages.get(sku_id, ()))
+
+    def allocate_lines(self, line_skus, line_quantities):
+        feasible = []
+        picks = []
+        for sku, quantity in zip(line_skus, line_quantities):
+            success, line_picks = allocate_line(
+                self.storages.get(sku, ()), quantity)
+            feasible.append(success)
+            picks.append(line_picks)
+        return feasible, picks
+
+
+def allocate_line(storages, quantity):
+    """
+    Picks `quantity` from (id, stock) storages in order. Returns
+    (success, picks).
+    """
+    picks = []
+    remaining_quantity = quantity
+    for storage_id, stock in storages:
+        if stock >= remaining_quantity:
+            picks.append({'id': storage_id, 'quantity': remaining_quantity})
+            remaining_quantity = 0
+            break
+        else:
+            picks.append({'id': storage_id, 'quantity': stock})
+            remaining_quantity -= stock
+    if remaining_quantity > 0:
+        return False, []
     return True, picks
@@ -2,6 +2,45 @@ from django.http import JsonResponse
 import unicodedata
 
 
+# Letters that NFD does not decompose, folded to their usual ASCII spelling
+LIGATURES = {
+    'ß': 'ss', 'ẞ': 'SS',
+    'æ': 'ae', 'Æ': 'AE',
+    'œ': 'oe', 'Œ': 'OE',
+    'ø': 'o', 'Ø': 'O',
+    'đ': 'd', 'Đ': 'D',
+    'ð': 'd', 'Ð': 'D',
+    'ł': 'l', 'Ł': 'L',
+    'ħ': 'h', 'Ħ': 'H',
+    'ŧ': 't', 'Ŧ': 'T',
+    'þ': 'th', 'Þ': 'TH',
+    'ı': 'i',
+    'ŀ': 'l', 'Ŀ': 'L',
+    'ŋ': 'n', 'Ŋ': 'N',
+}
+
+
+class FoldTable(dict):
+    """
+    Translation table for `str.translate` that folds each code point on
+    first use and memoizes the result.
+    """
+
+    def __missing__(self, code_point):
+        char = chr(code_point)
+        if char in LIGATURES:
+            folded = LIGATURES[char]
+        else:
+            folded = ''.join(
+                c for c in unicodedata.normalize('NFD', char)
+                if unicodedata.category(c) != 'Mn')
+        self[code_point] = folded
+        return folded
+
+
+fold_table = FoldTable()
+
+
 def convert_to_ascii(string):
     """
     Converts a string to ASCII characters.
@@ -9,16 +48,37 @@ def convert_to_ascii(string):
     if is_ascii(string):
         return string
     else:
-        return ''.join(
-            (c for c in unicodedata.normalize('NFD', string)
-                if unicodedata.category(c) != 'Mn'))
+        return string.translate(fold_table)
+
+
+def search_key(string):
+    """
+    Folds a string for ranked search: ASCII, lower case and single spaces.
+    """
+    return ' '.join(convert_to_ascii(string).lower().split())
 
 
 def is_ascii(string):
     """
     Returns true if a string contains only ASCII characters.
     """
-    return all(ord(char) < 128 for char in string)
+    return string.isascii()
+
+
+def is_true(value):
+    """
+    Returns true if a query parameter value switches an option on.
+    """
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def client_id(request):
+    """
+    Identifies the client of a request by its X-Client-Id header, falling
+    back to its address.
+    """
+    return request.META.get(
+        'HTTP_X_CLIENT_ID', request.META.get('REMOTE_ADDR', ''))
 
 
 def error_response(status_code, error_code, error_message):
@@ -0,0 +1,131 @@
+from datetime import timedelta
+import functools
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .db_router import untracked_writes
+from .helpers import error_response
+from .models import IdempotencyKey
+
+
+def idempotency_settings():
+    config = {'TTL': 24 * 60 * 60, 'LOCK_TIMEOUT': 60}
+    config.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return config
+
+
+def claim(key, request_hash, attempts=3):
+    """
+    Returns (stored, created): the stored response of a key, or a new
+    placeholder if the key is unused. Expired keys are reused, and so are
+    placeholders older than LOCK_TIMEOUT seconds, left by requests that
+    died. Returns (None, False) if the key kept being claimed and released
+    by other requests.
+    """
+    config = idempotency_settings()
+    for _ in range(attempts):
+        now = timezone.now()
+        IdempotencyKey.objects.filter(key=key).filter(
+            Q(created_at__lt=now - timedelta(seconds=config['TTL'])) |
+            Q(status_code__isnull=True, created_at__lt=now - timedelta(
+                seconds=config['LOCK_TIMEOUT']))).delete()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    key=key, request_hash=request_hash), True
+        except IntegrityError:
+            # The row may be deleted again before it is read
+            stored = IdempotencyKey.objects.filter(key=key).first()
+            if stored is not None:
+                return stored, False
+    return None, False
+
+
+def placeholder(stored):
+    """
+    Returns a queryset of the placeholder `stored`, which is empty once
+    another request has reclaimed the key after LOCK_TIMEOUT.
+    """
+    return IdempotencyKey.objects.filter(
+        pk=stored.pk, status_code__isnull=True, created_at=stored.created_at)
+
+
+def release(stored):
+    """
+    Deletes a placeholder so that the request can be retried.
+    """
+    placeholder(stored).delete()
+
+
+def replay(stored):
+    response = HttpResponse(
+        bytes(stored.content), status=stored.status_code,
+        content_type=stored.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Stores the response to a POST with an Idempotency-Key header, and
+    answers retries with the same key and body with it for TTL seconds,
+    without running the view. A key reused with a different body gets a
+    422, and a retry while the first request is still running a 409.
+
+    Server errors, streaming responses and admission rejections aren't
+    stored, so that the request can be retried.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY', None)
+        if key is None or request.method != 'POST':
+            return view(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            return error_response(
+                400, 18, "Header Idempotency-Key must have 1 to 255 "
+                "characters.")
+
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        # The keys are never read back through a replica, so writing them
+        # doesn't pin the client to the primary
+        with untracked_writes():
+            stored, created = claim(key, request_hash)
+        if stored is None:
+            return error_response(
+                409, 20, "A request with this Idempotency-Key is still in "
+                "progress.")
+        if not created:
+            if stored.request_hash != request_hash:
+                return error_response(
+                    422, 19, "Idempotency-Key was already used for a "
+                    "different request.")
+            if stored.status_code is None:
+                return error_response(
+                    409, 20, "A request with this Idempotency-Key is still "
+                    "in progress.")
+            return replay(stored)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            with untracked_writes():
+                release(stored)
+            raise
+        with untracked_writes():
+            if response.streaming or response.status_code >= 500 or \
+                    response.status_code == 429:
+                release(stored)
+            else:
+                # Updates nothing if the placeholder outlived LOCK_TIMEOUT
+                # and was reclaimed by another request
+                placeholder(stored).update(
+                    status_code=response.status_code,
+                    content_type=response.get('Content-Type', ''),
+                    content=response.content)
+        return response
+    return wrapper
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.snapshot import build_snapshot, snapshot_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the shared stock snapshot read by fulfillment, once or "
+        "every --interval seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=None,
+            help="Snapshot file, STOCK_SNAPSHOT['PATH'] by default.")
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Keep rebuilding the snapshot every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_settings()['PATH']
+        if not path:
+            raise CommandError(
+                "No snapshot path: pass --path or set STOCK_SNAPSHOT['PATH'].")
+
+        while True:
+            started = time.monotonic()
+            count = build_snapshot(path)
+            self.stdout.write(
+                "Wrote %d storages to %s in %.2fs" % (
+                    count, path, time.monotonic() - started))
+            if options['interval'] is None:
+                break
+            time.sleep(max(
+                options['interval'] - (time.monotonic() - started), 0))
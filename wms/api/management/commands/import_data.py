@@ -0,0 +1,253 @@
+import csv
+import io
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from api.helpers import convert_to_ascii, search_key
+from api.models import SKU, Storage, Order, OrderLine, Warehouse
+
+
+def positive_int(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError("%s is not a positive int" % value)
+    return value
+
+
+# Import specs in dependency order: option name, model, and the source
+# field, model column and converter of every column. Foreign keys are
+# given as the option name of the referenced import. Fields of nullable
+# columns may be missing or empty.
+IMPORTS = (
+    ('skus', SKU, (
+        ('id', 'id', positive_int),
+        ('product_name', 'product_name', str),
+    )),
+    ('warehouses', Warehouse, (
+        ('id', 'id', positive_int),
+        ('name', 'name', str),
+    )),
+    ('storages', Storage, (
+        ('id', 'id', positive_int),
+        ('sku', 'sku_id', 'skus'),
+        ('stock', 'stock', positive_int),
+        ('warehouse', 'warehouse_id', 'warehouses'),
+    )),
+    ('orders', Order, (
+        ('id', 'id', positive_int),
+        ('customer_name', 'customer_name', str),
+    )),
+    ('order_lines', OrderLine, (
+        ('id', 'id', positive_int),
+        ('order', 'order_id', 'orders'),
+        ('sku', 'sku_id', 'skus'),
+        ('quantity', 'quantity', positive_int),
+    )),
+)
+
+
+def copy_value(value):
+    """
+    Formats a value as a field of COPY ... CSV, which reads unquoted empty
+    fields as NULL: strings are always quoted, so that empty ones stay
+    strings.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return '"%s"' % value.replace('"', '""')
+    return str(value)
+
+
+def read_records(path):
+    """
+    Streams records from a CSV (with header) or NDJSON file as dicts,
+    with their line number. Lines that can't be decoded raise a
+    CommandError.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.csv', '.ndjson', '.jsonl'):
+        raise CommandError(
+            "Unsupported file type %s: expected .csv, .ndjson or .jsonl."
+            % path)
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f) if extension == '.csv' else None
+        line_number = 0
+        try:
+            if reader is not None:
+                for record in reader:
+                    yield reader.line_num, record
+            else:
+                for line_number, line in enumerate(f, 1):
+                    if line.strip():
+                        yield line_number, json.loads(line)
+        except (csv.Error, ValueError) as e:
+            # Also catches undecodable bytes (UnicodeDecodeError)
+            if reader is not None:
+                line_number = reader.line_num
+            raise CommandError(
+                "%s, line %d: %s" % (path, line_number, e)) from e
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk imports SKUs, warehouses, storages, orders and order lines "
+        "from CSV or NDJSON files, in batches of one transaction each.")
+
+    def add_arguments(self, parser):
+        for name, model, columns in IMPORTS:
+            parser.add_argument(
+                '--%s' % name.replace('_', '-'), metavar='PATH',
+                help="CSV or NDJSON file of %s with fields %s." % (
+                    name.replace('_', ' '),
+                    ', '.join(field for field, _, _ in columns)))
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Number of rows inserted per transaction.")
+
+    def handle(self, *args, **options):
+        if not any(options[name] for name, _, _ in IMPORTS):
+            raise CommandError("Nothing to import.")
+
+        # Ids of rows that can be referenced by foreign keys. Other ids are
+        # left to the primary key constraint, to bound memory use
+        known_ids = {}
+        referenced = {
+            converter for _, _, columns in IMPORTS
+            for _, _, converter in columns if isinstance(converter, str)}
+
+        for name, model, columns in IMPORTS:
+            path = options[name]
+            ids = None
+            if name in referenced:
+                ids = set(model.all_objects.values_list('id', flat=True))
+                known_ids[name] = ids
+            if path:
+                self.import_file(
+                    path, name, model, columns, known_ids, ids,
+                    options['batch_size'])
+
+        if connection.vendor == 'postgresql':
+            # Explicit ids don't advance sequences
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), [model for _, model, _ in IMPORTS]):
+                    cursor.execute(sql)
+
+    def import_file(
+            self, path, name, model, columns, known_ids, ids, batch_size):
+        attnames = [attname for _, attname, _ in columns]
+        # The database has no default for zone, only the model field
+        if model is Storage:
+            attnames.append('zone')
+        if model is Order:
+            attnames.extend(['customer_name_ascii', 'customer_name_key'])
+            attnames.extend(Order.AGGREGATES)
+        # Set explicitly for COPY, which bypasses auto_now(_add)
+        attnames.extend(['created_at', 'updated_at'])
+        now = timezone.now()
+
+        started = time.monotonic()
+        count = 0
+        batch = []
+        first_line = None
+        for line_number, record in read_records(path):
+            try:
+                row = self.convert(record, model, columns, known_ids)
+            except (TypeError, ValueError) as e:
+                raise CommandError("%s, line %d: %s" % (
+                    path, line_number, e)) from e
+            if ids is not None:
+                if row[0] in ids:
+                    raise CommandError("%s, line %d: duplicate id %d" % (
+                        path, line_number, row[0]))
+                ids.add(row[0])
+            if model is Storage:
+                row.append('')
+            if model is Order:
+                row.extend([convert_to_ascii(row[1]), search_key(row[1])])
+                row.extend([0] * len(Order.AGGREGATES))
+            row.extend([now, now])
+            batch.append(row)
+            if first_line is None:
+                first_line = line_number
+            if len(batch) >= batch_size:
+                count += self.insert(
+                    model, attnames, batch, path, first_line, line_number)
+                batch = []
+                first_line = None
+        if batch:
+            count += self.insert(
+                model, attnames, batch, path, first_line, line_number)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d %s from %s in %.1fs, %.0f rows/s" % (
+                count, name.replace('_', ' '), path, elapsed,
+                count / elapsed if elapsed else 0)))
+
+    def convert(self, record, model, columns, known_ids):
+        row = []
+        for field, attname, converter in columns:
+            if record.get(field) in (None, '') and \
+                    model._meta.get_field(attname).null:
+                row.append(None)
+                continue
+            if field not in record:
+                raise ValueError("missing field %s" % field)
+            if isinstance(converter, str):
+                value = positive_int(record[field])
+                if value not in known_ids[converter]:
+                    raise ValueError("%s %s does not exist" % (field, value))
+            else:
+                value = converter(record[field])
+            row.append(value)
+        return row
+
+    def insert(self, model, attnames, rows, path, first_line, last_line):
+        """
+        Inserts a batch of rows, read from lines `first_line` to
+        `last_line` of `path`, in one transaction, with COPY on PostgreSQL
+        and multi-row INSERTs through bulk_create elsewhere.
+        """
+        try:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    self.copy(model, attnames, rows)
+                else:
+                    # bulk_create splits the batch into the largest
+                    # multi-row INSERTs the backend accepts
+                    model.objects.bulk_create(
+                        [model(**dict(zip(attnames, row))) for row in rows])
+                if model is OrderLine:
+                    order_id = attnames.index('order_id')
+                    Order.rebuild_aggregates(
+                        {row[order_id] for row in rows})
+        except IntegrityError as e:
+            # Ids of rows that foreign keys don't reference aren't kept in
+            # memory, so the primary key catches their duplicates
+            raise CommandError("%s, lines %d-%d: %s" % (
+                path, first_line, last_line, e)) from e
+        return len(rows)
+
+    def copy(self, model, attnames, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(map(copy_value, row)) + '\n')
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        # Unlike execute(), copy_expert() doesn't turn driver errors into
+        # Django's
+        with connection.wrap_database_errors, connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (
+                    quote(model._meta.db_table),
+                    ', '.join(quote(model._meta.get_field(a).column)
+                              for a in attnames)),
+                buffer)
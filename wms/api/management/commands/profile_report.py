@@ -0,0 +1,65 @@
+import io
+import os
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import PROFILE_NAME, profiling_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarizes the request profiles in PROFILING['DIRECTORY'] per view "
+        "and reports the top functions across them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory', default=None,
+            help="Profile directory, PROFILING['DIRECTORY'] by default.")
+        parser.add_argument(
+            '--view', default=None,
+            help="Only report profiles of views whose name contains VIEW.")
+        parser.add_argument(
+            '--sort', default='cumulative',
+            choices=('cumulative', 'tottime', 'calls'),
+            help="Order of the top functions.")
+        parser.add_argument(
+            '--limit', type=int, default=25,
+            help="Number of top functions reported.")
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or profiling_settings()['DIRECTORY']
+        if not directory or not os.path.isdir(directory):
+            raise CommandError(
+                "No profile directory: pass --directory or set "
+                "PROFILING['DIRECTORY'].")
+
+        views = {}
+        paths = []
+        for name in sorted(os.listdir(directory)):
+            match = PROFILE_NAME.match(name)
+            if match is None:
+                continue
+            if options['view'] and options['view'] not in match['view']:
+                continue
+            views.setdefault(match['view'], []).append(
+                (int(match['ms']), int(match['queries'])))
+            paths.append(os.path.join(directory, name))
+        if not paths:
+            raise CommandError("No profiles found in %s." % directory)
+
+        self.stdout.write("%-40s %8s %9s %9s %9s" % (
+            'view', 'profiles', 'mean ms', 'max ms', 'queries'))
+        for view, samples in sorted(views.items()):
+            latencies = [ms for ms, _ in samples]
+            self.stdout.write("%-40s %8d %9.1f %9d %9.1f" % (
+                view, len(samples), sum(latencies) / len(samples),
+                max(latencies),
+                sum(queries for _, queries in samples) / len(samples)))
+
+        # pstats prints piecemeal, which OutputWrapper would break into lines
+        report = io.StringIO()
+        stats = pstats.Stats(*paths, stream=report)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(
+            options['limit'])
+        self.stdout.write(report.getvalue())
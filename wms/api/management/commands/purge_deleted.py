@@ -0,0 +1,76 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import SKU, Storage, Order, OrderLine, Tombstone, Warehouse
+
+
+# Models in purge order, each with the models whose rows may reference it:
+# referencing rows are purged first, and rows still referenced are kept
+PURGES = [
+    (OrderLine, []),
+    (Storage, []),
+    (Warehouse, [(Storage, 'warehouse_id')]),
+    (Order, [(OrderLine, 'order_id')]),
+    (SKU, [(Storage, 'sku_id'), (OrderLine, 'sku_id')]),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Hard-deletes rows soft-deleted more than --days days ago, and "
+        "deletion records of delta syncs as old, in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help="Only purge rows deleted at least this many days ago. "
+                 "Clients that sync less often must resync from scratch.")
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of rows deleted per transaction.")
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['batch_size'] < 1:
+            raise CommandError(
+                "--days can't be negative and --batch-size must be at "
+                "least 1.")
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        for model, referencing in PURGES:
+            queryset = model.all_objects.filter(deleted_at__lt=cutoff)
+            for other, column in referencing:
+                queryset = queryset.exclude(
+                    id__in=other.all_objects.values(column))
+            purged = self.purge(queryset, batch_size)
+            self.stdout.write(
+                "Purged %d %s rows" % (purged, model._meta.model_name))
+
+        purged = self.purge(
+            Tombstone.objects.filter(deleted_at__lt=cutoff), batch_size)
+        self.stdout.write("Purged %d deletion records" % purged)
+        self.stdout.write(
+            "Done in %.1fs" % (time.monotonic() - started))
+
+    def purge(self, queryset, batch_size):
+        """
+        Deletes the rows of a queryset in batches of ids, so that no
+        transaction holds locks on many rows. Returns the number deleted.
+        """
+        purged = 0
+        last_id = 0
+        while True:
+            ids = list(
+                queryset.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return purged
+            with transaction.atomic():
+                queryset.model._base_manager.filter(id__in=ids).delete()
+            purged += len(ids)
+            last_id = ids[-1]
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.idempotency import idempotency_settings
+from api.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes idempotency keys older than IDEMPOTENCY['TTL'] seconds, "
+        "in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of keys deleted per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        cutoff = timezone.now() - timedelta(
+            seconds=idempotency_settings()['TTL'])
+
+        purged = 0
+        while True:
+            ids = list(
+                IdempotencyKey.objects.filter(created_at__lt=cutoff)
+                .order_by('created_at').values_list('id', flat=True)
+                [:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                IdempotencyKey.objects.filter(id__in=ids).delete()
+            purged += len(ids)
+        self.stdout.write("Purged %d expired idempotency keys" % purged)
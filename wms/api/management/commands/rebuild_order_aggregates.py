@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the line count, total units and distinct SKUs of "
+        "orders from their lines, in chunks, e.g. after lines were written "
+        "with queryset.update(), raw SQL or fixtures.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help="Number of orders updated per transaction.")
+        parser.add_argument(
+            '--after-id', type=int, default=0,
+            help="Resume after this order id (the last id reported).")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['after_id']
+
+        processed = 0
+        started = time.monotonic()
+
+        while True:
+            ids = list(
+                Order.all_objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+
+            with transaction.atomic():
+                Order.rebuild_aggregates(ids)
+
+            last_id = ids[-1]
+            processed += len(ids)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                "Processed %d orders up to id %d, %.0f rows/s" % (
+                    processed, last_id,
+                    processed / elapsed if elapsed else 0))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the aggregates of %d orders, last id %d." % (
+                processed, last_id)))
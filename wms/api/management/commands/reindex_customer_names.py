@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.helpers import convert_to_ascii, search_key
+from api.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes Order.customer_name_ascii and customer_name_key in "
+        "chunks, e.g. for rows loaded with bulk_create, raw SQL or "
+        "fixtures.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help="Number of orders read and updated per transaction.")
+        parser.add_argument(
+            '--after-id', type=int, default=0,
+            help="Resume after this order id (the last id reported).")
+        parser.add_argument(
+            '--only-stale', action='store_true',
+            help="Only write rows whose folded name is out of date.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['after_id']
+        only_stale = options['only_stale']
+
+        processed = 0
+        updated = 0
+        started = time.monotonic()
+
+        while True:
+            rows = list(
+                Order.all_objects.filter(id__gt=last_id).order_by('id')
+                .values_list(
+                    'id', 'customer_name', 'customer_name_ascii',
+                    'customer_name_key')[:chunk_size])
+            if not rows:
+                break
+
+            orders = []
+            for order_id, customer_name, customer_name_ascii, \
+                    customer_name_key in rows:
+                folded = convert_to_ascii(customer_name)
+                key = search_key(customer_name)
+                if only_stale and folded == customer_name_ascii and \
+                        key == customer_name_key:
+                    continue
+                orders.append(Order(
+                    id=order_id, customer_name_ascii=folded,
+                    customer_name_key=key))
+
+            with transaction.atomic():
+                Order.all_objects.bulk_update(
+                    orders, ['customer_name_ascii', 'customer_name_key'],
+                    batch_size=chunk_size)
+
+            last_id = rows[-1][0]
+            processed += len(rows)
+            updated += len(orders)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                "Processed %d orders (%d updated) up to id %d, "
+                "%.0f rows/s" % (
+                    processed, updated, last_id,
+                    processed / elapsed if elapsed else 0))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Reindexed %d of %d orders, last id %d." % (
+                updated, processed, last_id)))
@@ -0,0 +1,202 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import db_router
+
+
+# Compression
+
+
+class GzipEncoder(object):
+    """
+    Incremental gzip encoder. On API responses level 4 compresses about as
+    well as zlib's default of 6 for a third of the CPU.
+    """
+    encoding = 'gzip'
+
+    def __init__(self, level=4):
+        self.compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder(object):
+    """
+    Incremental brotli encoder. Quality 4 compresses better than gzip at a
+    lower CPU cost, which suits dynamic responses.
+    """
+    encoding = 'br'
+
+    def __init__(self, level=4):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdEncoder(object):
+    """
+    Incremental zstd encoder. Level 3 is the fastest of the three encoders
+    and compresses about as well as brotli quality 6.
+    """
+    encoding = 'zstd'
+
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Encoders in order of preference, if their library is installed
+ENCODERS = [encoder for encoder, available in (
+    (ZstdEncoder, zstandard is not None),
+    (BrotliEncoder, brotli is not None),
+    (GzipEncoder, True),
+) if available]
+
+
+def parse_accept_encoding(header):
+    """
+    Returns a dict of content codings to their q-values from an
+    Accept-Encoding header.
+    """
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoder(header):
+    """
+    Returns the encoder class for the best available coding the client
+    accepts, or None.
+    """
+    accepted = parse_accept_encoding(header)
+    best = None
+    best_q = 0.0
+    for encoder in ENCODERS:
+        q = accepted.get(encoder.encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoder, q
+    return best
+
+
+def compress_sequence(encoder, sequence):
+    """
+    Compresses an iterable of chunks, flushing after every chunk so that
+    clients receive data as it is produced.
+    """
+    for chunk in sequence:
+        data = encoder.compress(chunk)
+        data += encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses responses with zstd, brotli or gzip, as negotiated with the
+    Accept-Encoding header. Responses smaller than COMPRESSION_MIN_SIZE
+    bytes are sent as they are; streaming responses are compressed chunk
+    by chunk.
+    """
+
+    def process_response(self, request, response):
+        min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoder_class = choose_encoder(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoder_class is None:
+            return response
+        encoder = encoder_class()
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(
+                encoder, response.streaming_content)
+            del response['Content-Length']
+        else:
+            content = encoder.compress(response.content) + encoder.finish()
+            # Return the compressed content only if it's actually shorter
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # Compressed representations can't match a strong ETag
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoder.encoding
+
+        return response
+
+
+# Read replicas
+
+
+class ReplicaPinningMiddleware(MiddlewareMixin):
+    """
+    Pins clients that wrote during a request to the primary database for
+    READ_YOUR_WRITES_SECONDS, so that replica lag can't hide their writes.
+    """
+
+    def process_request(self, request):
+        db_router.reset_writes()
+
+    def process_response(self, request, response):
+        db_router.pin_if_wrote(request)
+        return response
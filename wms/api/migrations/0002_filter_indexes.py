@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(fields=['order', 'sku'], name='api_orderli_order_i_2f0601_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(fields=['sku', 'stock'], name='api_storage_sku_id_471401_idx'),
+        ),
+    ]
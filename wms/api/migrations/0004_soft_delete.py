@@ -0,0 +1,81 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_delta_sync'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='orderline',
+            name='api_orderli_order_i_2f0601_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='storage',
+            name='api_storage_sku_id_471401_idx',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='sku',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['id'], name='api_order_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='api_order_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['id'], name='api_orderline_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['order', 'sku'], name='api_orderline_active_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='api_orderline_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['id'], name='api_sku_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sku',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='api_sku_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['id'], name='api_storage_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['sku', 'stock', 'id'], name='api_storage_active_sku_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='api_storage_deleted_idx'),
+        ),
+    ]
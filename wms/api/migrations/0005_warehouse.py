@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Warehouse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='warehouse',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='api.Warehouse'),
+        ),
+        migrations.AddIndex(
+            model_name='storage',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['warehouse', 'sku', 'stock', 'id'], name='api_storage_active_site_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehouse',
+            index=models.Index(fields=['updated_at', 'id'], name='api_warehou_updated_33630b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehouse',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['id'], name='api_warehouse_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='warehouse',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='api_warehouse_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_warehouse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storage',
+            name='aisle',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='bay',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='level',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storage',
+            name='zone',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
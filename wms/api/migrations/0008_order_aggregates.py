@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_aggregates(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    OrderLine = apps.get_model('api', 'OrderLine')
+    lines = OrderLine.objects.filter(
+        order_id=OuterRef('pk'), deleted_at__isnull=True).order_by().values(
+            'order_id')
+    Order.objects.update(
+        line_count=Coalesce(Subquery(
+            lines.annotate(value=Count('id')).values('value')), 0),
+        total_units=Coalesce(Subquery(
+            lines.annotate(value=Sum('quantity')).values('value')), 0),
+        distinct_skus=Coalesce(Subquery(
+            lines.annotate(value=Count('sku_id', distinct=True))
+            .values('value')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='distinct_skus',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_units',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['line_count', 'id'], name='api_order_active_lines_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['total_units', 'id'], name='api_order_active_units_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(deleted_at__isnull=True), fields=['distinct_skus', 'id'], name='api_order_active_skus_idx'),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-19 10:42
+
+from django.db import migrations, models
+
+from api.helpers import search_key
+
+
+def fill_search_keys(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    orders = []
+    for order_id, customer_name in Order.objects.order_by('id').values_list(
+            'id', 'customer_name').iterator(chunk_size=5000):
+        orders.append(
+            Order(id=order_id, customer_name_key=search_key(customer_name)))
+        if len(orders) >= 5000:
+            Order.objects.bulk_update(orders, ['customer_name_key'])
+            orders = []
+    Order.objects.bulk_update(orders, ['customer_name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_order_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='customer_name_key',
+            field=models.CharField(
+                db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
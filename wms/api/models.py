@@ -1,31 +1,361 @@
-from django.db import models
-from .helpers import convert_to_ascii
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from .helpers import convert_to_ascii, search_key
+
+# Sent with the ids of rows soft-deleted in one update, which doesn't send
+# post_save for them
+bulk_soft_deleted = Signal(providing_args=['ids'])
 
 # Models
 
 
-class SKU(models.Model):
+class ActiveManager(models.Manager):
+    """
+    Default manager that hides soft-deleted rows.
+    """
+
+    def get_queryset(self):
+        return super(ActiveManager, self).get_queryset().filter(
+            deleted_at__isnull=True)
+
+
+class TimestampedModel(models.Model):
+    """
+    Records when rows are created, last updated and soft-deleted.
+
+    Deleting through the API only sets `deleted_at`: `objects` hides
+    deleted rows, `all_objects` sees them, and the `purge_deleted` command
+    removes them for good once they are old enough.
+    """
+    # A default rather than auto_now_add, so that saving an unsaved
+    # instance with the pk of an existing row still works
+    created_at = models.DateTimeField(
+        default=timezone.now, editable=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+
+    def soft_delete(self):
+        """
+        Marks the row deleted, along with its dependent rows. Dependent
+        rows are marked in one update, so they can't have dependents of
+        their own.
+        """
+        with transaction.atomic():
+            now = timezone.now()
+            dependents = self.soft_delete_dependents()
+            if dependents is not None:
+                ids = list(dependents.values_list('id', flat=True))
+                if ids:
+                    dependents.model.all_objects.filter(id__in=ids).update(
+                        deleted_at=now, updated_at=now)
+                    bulk_soft_deleted.send(sender=dependents.model, ids=ids)
+            self.deleted_at = now
+            self.save(update_fields=['deleted_at', 'updated_at'])
+
+    def soft_delete_dependents(self):
+        """
+        Returns a queryset of the rows deleted with this one, if any.
+        """
+        return None
+
+
+# Soft-deleted rows are excluded from these indexes, so queries through the
+# default manager never touch them
+ACTIVE = models.Q(deleted_at__isnull=True)
+
+DELETED = models.Q(deleted_at__isnull=False)
+
+
+class SKU(TimestampedModel):
     product_name = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [
+            # Keyset order of delta syncs
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(
+                fields=['id'], name='api_sku_active_idx', condition=ACTIVE),
+            models.Index(
+                fields=['deleted_at'], name='api_sku_deleted_idx',
+                condition=DELETED),
+        ]
+
+    def soft_delete_dependents(self):
+        return self.storage_set.all()
+
+
+class Warehouse(TimestampedModel):
+    name = models.CharField(max_length=255)
 
-class Storage(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(
+                fields=['id'], name='api_warehouse_active_idx',
+                condition=ACTIVE),
+            models.Index(
+                fields=['deleted_at'], name='api_warehouse_deleted_idx',
+                condition=DELETED),
+        ]
+
+    def soft_delete_dependents(self):
+        return self.storage_set.all()
+
+
+class Storage(TimestampedModel):
     stock = models.PositiveIntegerField()
     sku = models.ForeignKey(SKU, on_delete=models.PROTECT)
+    # Storages without a warehouse form a pool of their own
+    warehouse = models.ForeignKey(
+        Warehouse, on_delete=models.PROTECT, null=True, blank=True)
+    # Location inside the warehouse, for pick routes: aisles are numbered
+    # in walking order across the zone, bays from the front of the aisle
+    zone = models.CharField(max_length=16, blank=True, default='')
+    aisle = models.PositiveIntegerField(null=True, blank=True)
+    bay = models.PositiveIntegerField(null=True, blank=True)
+    level = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(
+                fields=['id'], name='api_storage_active_idx',
+                condition=ACTIVE),
+            # Storages of an SKU by stock: sku and stock range filters
+            models.Index(
+                fields=['sku', 'stock', 'id'],
+                name='api_storage_active_sku_idx', condition=ACTIVE),
+            # The same within a warehouse: least-stock-first picking, which
+            # plans one warehouse at a time
+            models.Index(
+                fields=['warehouse', 'sku', 'stock', 'id'],
+                name='api_storage_active_site_idx', condition=ACTIVE),
+            models.Index(
+                fields=['deleted_at'], name='api_storage_deleted_idx',
+                condition=DELETED),
+        ]
 
 
-class Order(models.Model):
+class Order(TimestampedModel):
     customer_name = models.CharField(max_length=255)
     customer_name_ascii = models.CharField(max_length=255)
+    # Folded, lower-case name for ranked search; db_index also gets a
+    # pattern index for prefix LIKEs on PostgreSQL
+    customer_name_key = models.CharField(
+        max_length=255, default='', db_index=True, editable=False)
+    # Aggregates of the order's lines that aren't deleted, kept up to date
+    # by OrderLine
+    line_count = models.PositiveIntegerField(default=0, editable=False)
+    total_units = models.PositiveIntegerField(default=0, editable=False)
+    distinct_skus = models.PositiveIntegerField(default=0, editable=False)
+
+    AGGREGATES = ('line_count', 'total_units', 'distinct_skus')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(
+                fields=['id'], name='api_order_active_idx', condition=ACTIVE),
+            models.Index(
+                fields=['deleted_at'], name='api_order_deleted_idx',
+                condition=DELETED),
+            # Filtering and sorting by aggregates
+            models.Index(
+                fields=['line_count', 'id'], name='api_order_active_lines_idx',
+                condition=ACTIVE),
+            models.Index(
+                fields=['total_units', 'id'],
+                name='api_order_active_units_idx', condition=ACTIVE),
+            models.Index(
+                fields=['distinct_skus', 'id'],
+                name='api_order_active_skus_idx', condition=ACTIVE),
+        ]
 
     def save(self, *args, **kwargs):
         """
         Save an ascii version of the customer name for search
         """
         self.customer_name_ascii = convert_to_ascii(self.customer_name)
+        self.customer_name_key = search_key(self.customer_name)
+        # Aggregates are only written by their own updates, so that saving
+        # a stale instance can't undo them
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.AGGREGATES]
         super(Order, self).save(*args, **kwargs)
 
+    def soft_delete_dependents(self):
+        return self.orderline_set.all()
+
+    @staticmethod
+    def distinct_skus_subquery():
+        return Coalesce(Subquery(
+            OrderLine.objects.filter(order_id=OuterRef('pk'))
+            .order_by().values('order_id')
+            .annotate(count=Count('sku_id', distinct=True))
+            .values('count')), 0)
 
-class OrderLine(models.Model):
+    @classmethod
+    def update_aggregates(cls, order_id, lines, units, recount_skus):
+        """
+        Adds `lines` and `units` to an order's aggregates, and recounts its
+        distinct SKUs if they may have changed.
+        """
+        changes = {
+            'line_count': F('line_count') + lines,
+            'total_units': F('total_units') + units,
+            # Delta syncs must see the change
+            'updated_at': timezone.now(),
+        }
+        if recount_skus:
+            changes['distinct_skus'] = cls.distinct_skus_subquery()
+        cls.all_objects.filter(id=order_id).update(**changes)
+
+    @classmethod
+    def rebuild_aggregates(cls, order_ids):
+        """
+        Recomputes the aggregates of the given orders from their lines, for
+        lines written in bulk.
+        """
+        lines = OrderLine.objects.filter(order_id__in=order_ids).order_by()
+        cls.all_objects.filter(id__in=order_ids).update(
+            line_count=Coalesce(Subquery(
+                lines.filter(order_id=OuterRef('pk')).values('order_id')
+                .annotate(count=Count('id')).values('count')), 0),
+            total_units=Coalesce(Subquery(
+                lines.filter(order_id=OuterRef('pk')).values('order_id')
+                .annotate(units=Sum('quantity')).values('units')), 0),
+            distinct_skus=cls.distinct_skus_subquery(),
+            updated_at=timezone.now())
+
+
+class OrderLine(TimestampedModel):
     sku = models.ForeignKey(SKU, on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField()
     order = models.ForeignKey(Order, on_delete=models.PROTECT)
+
+    AGGREGATED = ('order_id', 'sku_id', 'quantity', 'deleted_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+            models.Index(
+                fields=['id'], name='api_orderline_active_idx',
+                condition=ACTIVE),
+            # Lines of an order, optionally narrowed down to an SKU
+            models.Index(
+                fields=['order', 'sku'], name='api_orderline_active_order_idx',
+                condition=ACTIVE),
+            models.Index(
+                fields=['deleted_at'], name='api_orderline_deleted_idx',
+                condition=DELETED),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(OrderLine, cls).from_db(db, field_names, values)
+        # Remember what the row counted for in its order's aggregates
+        if not set(cls.AGGREGATED) & instance.get_deferred_fields():
+            instance._aggregated = instance.aggregated()
+        return instance
+
+    def aggregated(self):
+        """
+        Returns (order_id, sku_id, quantity) if the line counts in its
+        order's aggregates, or None.
+        """
+        if self.deleted_at is not None:
+            return None
+        return self.order_id, self.sku_id, self.quantity
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the line and updates the aggregates of its order, and of the
+        order it was moved from, in the same transaction.
+        """
+        with transaction.atomic():
+            old = None
+            if self.pk is not None:
+                # Read what the row counts for under a lock rather than
+                # from this instance, so that concurrent saves of the line
+                # apply their deltas one after the other
+                row = OrderLine.all_objects.select_for_update().filter(
+                    id=self.pk).values_list(*self.AGGREGATED).first()
+                if row is not None and row[3] is None:
+                    old = row[:3]
+            super(OrderLine, self).save(*args, **kwargs)
+            new = self.aggregated()
+            update_order_aggregates(old, new)
+            self._aggregated = new
+
+
+def update_order_aggregates(old, new):
+    """
+    Applies a line's change from `old` to `new` (see
+    `OrderLine.aggregated()`) to the aggregates of its orders.
+    """
+    if old == new:
+        return
+    # Only a change of order or SKU, or a line (dis)appearing, can change
+    # the distinct SKUs
+    recount = old is None or new is None or old[:2] != new[:2]
+    if old is not None and new is not None and old[0] == new[0]:
+        Order.update_aggregates(old[0], 0, new[2] - old[2], recount)
+        return
+    if old is not None:
+        Order.update_aggregates(old[0], -1, -old[2], recount)
+    if new is not None:
+        Order.update_aggregates(new[0], 1, new[2], recount)
+
+
+@receiver(post_delete, sender=OrderLine)
+def remove_from_order_aggregates(sender, instance, **kwargs):
+    update_order_aggregates(
+        getattr(instance, '_aggregated', instance.aggregated()), None)
+
+
+@receiver(bulk_soft_deleted, sender=OrderLine)
+def rebuild_order_aggregates(sender, ids, **kwargs):
+    Order.rebuild_aggregates(
+        OrderLine.all_objects.filter(id__in=ids).values('order_id'))
+
+
+class Tombstone(models.Model):
+    """
+    Records the deletion of a row, so that delta syncs can tell clients to
+    drop it.
+    """
+    model = models.CharField(max_length=32)
+    object_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'deleted_at']),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to a request made with an Idempotency-Key header, which
+    retries of the request get instead of a new one.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    # SHA-256 of the request body
+    request_hash = models.CharField(max_length=64)
+    # Null while the first request is being handled
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    content = models.BinaryField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
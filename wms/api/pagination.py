@@ -0,0 +1,10 @@
+from rest_framework import pagination
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """
+    Page number pagination that lets clients ask for larger pages with a
+    `page_size` query parameter.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,121 @@
+import cProfile
+from datetime import datetime
+import functools
+import glob
+import os
+import random
+import re
+import time
+
+from django.conf import settings
+
+from .query_budget import recording_queries
+
+
+# Profile file names: start time, view, latency, query count and process
+PROFILE_NAME = re.compile(
+    r'^(?P<started>[0-9T.]+)-(?P<view>.+)-(?P<ms>\d+)ms-(?P<queries>\d+)q-'
+    r'(?P<pid>\d+)\.prof$')
+
+
+def profiling_settings():
+    config = {
+        'DIRECTORY': None,
+        'SAMPLE_RATE': 0.0,
+        'TOKEN': None,
+        'MAX_FILES': 500,
+    }
+    config.update(getattr(settings, 'PROFILING', {}))
+    return config
+
+
+def wants_profile(request, config):
+    """
+    Returns true if a request sent TOKEN in the X-Profile header or
+    `profile` query parameter, or was sampled at SAMPLE_RATE. Without a
+    TOKEN, only sampled requests are profiled.
+    """
+    flag = request.META.get('HTTP_X_PROFILE') or request.GET.get('profile')
+    if config['TOKEN'] and flag == config['TOKEN']:
+        return True
+    return random.random() < config['SAMPLE_RATE']
+
+
+def profile_name(started, view_name, seconds, queries):
+    return '%s-%s-%dms-%dq-%d.prof' % (
+        started.strftime('%Y%m%dT%H%M%S.%f'),
+        re.sub(r'[^\w.]', '_', view_name), seconds * 1000, queries,
+        os.getpid())
+
+
+def write_profile(profiler, directory, name, max_files):
+    """
+    Dumps a profile to `directory`, then removes the oldest profiles
+    beyond `max_files`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    temporary = '%s.tmp' % path
+    profiler.dump_stats(temporary)
+    os.replace(temporary, path)
+    # Names start with the time, so they sort oldest first
+    profiles = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    for old in profiles[:max(len(profiles) - max_files, 0)]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+
+
+def run_profiled(request, view_name, call):
+    """
+    Runs `call()`, under cProfile if profiling is on and the request wants
+    it. `view_name` is a function returning the name profiles are tagged
+    with. Profiled responses name their profile in an X-Profile header.
+    """
+    config = profiling_settings()
+    if not config['DIRECTORY'] or not wants_profile(request, config):
+        return call()
+
+    profiler = cProfile.Profile()
+    started = datetime.now()
+    start = time.perf_counter()
+    with recording_queries() as recorder:
+        profiler.enable()
+        try:
+            response = call()
+        finally:
+            profiler.disable()
+    name = profile_name(
+        started, view_name(), time.perf_counter() - start,
+        len(recorder.queries))
+    write_profile(profiler, config['DIRECTORY'], name, config['MAX_FILES'])
+    response['X-Profile'] = name
+    return response
+
+
+def profiled(view):
+    """
+    Decorates a function view that may be profiled (see `run_profiled()`).
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return run_profiled(
+            request, lambda: view.__name__,
+            lambda: view(request, *args, **kwargs))
+    return wrapper
+
+
+class ProfiledMixin(object):
+    """
+    Lets the requests of a viewset be profiled (see `run_profiled()`),
+    tagging profiles with the viewset and action.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        return run_profiled(
+            request,
+            lambda: '%s.%s' % (
+                self.__class__.__name__, getattr(self, 'action', None)),
+            lambda: super(ProfiledMixin, self).dispatch(
+                request, *args, **kwargs))
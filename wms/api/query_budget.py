@@ -0,0 +1,116 @@
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+import functools
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_violations = Counter()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def budget_settings():
+    config = {'ENABLED': True, 'STRICT': settings.DEBUG}
+    config.update(getattr(settings, 'QUERY_BUDGET', {}))
+    return config
+
+
+class QueryRecorder(object):
+    """
+    Database execute wrapper that records the SQL of queries.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def recording_queries():
+    """
+    Records the queries run on every database inside the block.
+    """
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+def violations():
+    """
+    Returns the number of budget violations of each view in this worker.
+    """
+    with _lock:
+        return dict(_violations)
+
+
+@contextmanager
+def within_budget(name, budget):
+    """
+    Checks that the block runs at most `budget` queries. Violations raise
+    QueryBudgetExceeded in STRICT mode (debug and test runs), and are
+    otherwise counted and logged with their SQL.
+    """
+    config = budget_settings()
+    if not config['ENABLED'] or budget is None:
+        yield
+        return
+
+    with recording_queries() as recorder:
+        yield
+    if len(recorder.queries) <= budget:
+        return
+
+    message = "%s ran %d queries, over its budget of %d:\n%s" % (
+        name, len(recorder.queries), budget, '\n'.join(recorder.queries))
+    if config['STRICT']:
+        raise QueryBudgetExceeded(message)
+    with _lock:
+        _violations[name] += 1
+    logger.warning(message)
+
+
+def query_budget(budget):
+    """
+    Decorates a function view that may run at most `budget` queries per
+    request, whatever its input (see `within_budget()`).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with within_budget(view.__name__, budget):
+                return view(request, *args, **kwargs)
+        wrapper.query_budget = budget
+        return wrapper
+    return decorator
+
+
+class QueryBudgetMixin(object):
+    """
+    Holds the actions of a viewset to the budgets in `query_budgets`, a
+    dict of action names to the most queries a request may run. Actions
+    without a budget aren't checked.
+    """
+    query_budgets = {'list': 2, 'retrieve': 1, 'multi_get': 1}
+
+    def dispatch(self, request, *args, **kwargs):
+        # self.action is only set once DRF has initialized the request
+        action = self.action_map.get(request.method.lower())
+        with within_budget(
+                '%s.%s' % (self.__class__.__name__, action),
+                self.query_budgets.get(action)):
+            return super(QueryBudgetMixin, self).dispatch(
+                request, *args, **kwargs)
@@ -0,0 +1,52 @@
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+def to_columns(results):
+    """
+    Converts a list of dicts with the same keys into a dict of lists.
+    """
+    if not results:
+        return {}
+    return {
+        field: [row[field] for row in results] for field in results[0]}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    Renders lists of objects as JSON with one array per field, e.g.
+    `{"id": [1, 2], "stock": [5, 8]}`, which is much smaller than repeating
+    every key on every row. Paginated responses keep their envelope with
+    columnar `results`; anything else renders as plain JSON.
+    """
+    media_type = 'application/vnd.wms.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, list) and all(isinstance(r, dict) for r in data):
+            data = to_columns(data)
+        elif isinstance(data, dict) and isinstance(
+                data.get('results', None), list):
+            data = dict(data, results=to_columns(data['results']))
+        return super(ColumnarJSONRenderer, self).render(
+            data, accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders MessagePack, a compact binary encoding of the same data as the
+    JSON renderer. Requires the msgpack package.
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True, default=str)
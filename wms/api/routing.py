@@ -0,0 +1,195 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from itertools import groupby
+import time
+
+from django.conf import settings
+
+
+S_SHAPE = 's-shape'
+OPTIMIZED = 'nn-2opt'
+
+
+def route_settings():
+    config = {
+        'AISLE_WIDTH': 3.0,
+        'BAY_WIDTH': 1.0,
+        'OPTIMIZE_MIN_PICKS': 20,
+        'MAX_OPTIMIZE_SECONDS': 0.05,
+    }
+    config.update(getattr(settings, 'PICK_ROUTE', {}))
+    return config
+
+
+class Layout(object):
+    """
+    Walking distances inside one zone of parallel aisles, joined by a
+    cross-aisle at the front (bay 0) and one past the last bay. Moving
+    within an aisle costs BAY_WIDTH per bay; changing aisles costs
+    AISLE_WIDTH per aisle, plus the walk out of the first aisle and into the
+    second through whichever cross-aisle is shorter. Levels are picked
+    without walking.
+    """
+
+    def __init__(self, stops, aisle_width, bay_width):
+        self.aisle_width = aisle_width
+        self.bay_width = bay_width
+        self.back = max(bay for _, bay, _ in stops) + 1
+
+    def distance(self, a, b):
+        if a[0] == b[0]:
+            return abs(a[1] - b[1]) * self.bay_width
+        return (
+            min(a[1] + b[1], 2 * self.back - a[1] - b[1]) * self.bay_width +
+            abs(a[0] - b[0]) * self.aisle_width)
+
+    def matrix(self, stops):
+        """
+        Returns the distance matrix of (aisle, bay, level) stops, as a
+        NumPy array when NumPy is installed and lists otherwise.
+        """
+        if np is None:
+            return [[self.distance(a, b) for b in stops] for a in stops]
+        aisles = np.array([stop[0] for stop in stops], dtype=np.float64)
+        bays = np.array([stop[1] for stop in stops], dtype=np.float64)
+        front = bays[:, None] + bays[None, :]
+        across = np.minimum(front, 2 * self.back - front) * self.bay_width + \
+            np.abs(aisles[:, None] - aisles[None, :]) * self.aisle_width
+        within = np.abs(bays[:, None] - bays[None, :]) * self.bay_width
+        return np.where(aisles[:, None] == aisles[None, :], within, across)
+
+
+def s_shape(stops):
+    """
+    Orders stops by the S-shape heuristic: every aisle with a stop is
+    walked end to end, front to back and back to front in turns.
+    """
+    order = sorted(range(len(stops)), key=lambda i: stops[i])
+    route = []
+    for turn, (_, aisle) in enumerate(
+            groupby(order, key=lambda i: stops[i][0])):
+        aisle = list(aisle)
+        route.extend(reversed(aisle) if turn % 2 else aisle)
+    return route
+
+
+def path_length(path, distances):
+    return sum(distances[a][b] for a, b in zip(path, path[1:]))
+
+
+def nearest_neighbour(distances):
+    """
+    Returns the path that always walks to the nearest unvisited stop,
+    starting from stop 0.
+    """
+    count = len(distances)
+    path = [0]
+    if np is not None:
+        visited = np.zeros(count, dtype=bool)
+        visited[0] = True
+        for _ in range(count - 1):
+            row = np.where(visited, np.inf, distances[path[-1]])
+            stop = int(np.argmin(row))
+            visited[stop] = True
+            path.append(stop)
+        return path
+    unvisited = set(range(1, count))
+    while unvisited:
+        row = distances[path[-1]]
+        stop = min(unvisited, key=lambda i: (row[i], i))
+        unvisited.remove(stop)
+        path.append(stop)
+    return path
+
+
+def two_opt(path, distances, deadline):
+    """
+    Improves a path that starts at its first stop by reversing segments
+    while that shortens it, until no reversal helps or `deadline` (a
+    `time.monotonic()` value) passes.
+    """
+    # A final stop at distance 0 from all others makes the open path a
+    # closed one, so every reversal has the same cost formula
+    count = len(distances)
+    end = count
+    if np is not None:
+        distances = np.pad(distances, ((0, 1), (0, 1)))
+        path = np.array(list(path) + [end])
+    else:
+        distances = [row + [0] for row in distances] + [[0] * (count + 1)]
+        path = list(path) + [end]
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(1, len(path) - 2):
+            a, b = path[i - 1], path[i]
+            if np is not None:
+                c = path[i + 1:-1]
+                d = path[i + 2:]
+                delta = distances[a, c] + distances[b, d] - \
+                    distances[a, b] - distances[c, d]
+                j = int(np.argmin(delta))
+                if delta[j] < -1e-9:
+                    path[i:i + j + 2] = path[i:i + j + 2][::-1].copy()
+                    improved = True
+            else:
+                for j in range(i + 1, len(path) - 1):
+                    c, d = path[j], path[j + 1]
+                    if distances[a][c] + distances[b][d] < \
+                            distances[a][b] + distances[c][d] - 1e-9:
+                        path[i:j + 1] = path[i:j + 1][::-1]
+                        b = path[i]
+                        improved = True
+            if time.monotonic() >= deadline:
+                break
+    return [int(stop) for stop in path[:-1]]
+
+
+def sequence_picks(picks, locations):
+    """
+    Orders picks along a walking route and returns (picks, method, length).
+
+    `locations` maps storage ids to (zone, aisle, bay, level). Zones are
+    walked one after the other in name order, each from the front of its
+    first aisle. Routes are S-shaped; plans of OPTIMIZE_MIN_PICKS or more
+    picks in a zone also try nearest neighbour, and the shorter route is
+    improved by 2-opt for at most MAX_OPTIMIZE_SECONDS. Picks of storages
+    without an aisle and bay come last, in plan order.
+    """
+    config = route_settings()
+    located = []
+    unlocated = []
+    for pick in picks:
+        location = locations.get(pick['id'])
+        if location is None or location[1] is None or location[2] is None:
+            unlocated.append(pick)
+        else:
+            zone, aisle, bay, level = location
+            located.append((zone, (aisle, bay, level or 0), pick))
+    located.sort(key=lambda item: item[0])
+
+    route = []
+    method = S_SHAPE
+    length = 0.0
+    deadline = time.monotonic() + config['MAX_OPTIMIZE_SECONDS']
+    for _, zone_picks in groupby(located, key=lambda item: item[0]):
+        zone_picks = list(zone_picks)
+        stops = [(min(stop for _, stop, _ in zone_picks)[0], 0, 0)] + [
+            stop for _, stop, _ in zone_picks]
+        layout = Layout(stops, config['AISLE_WIDTH'], config['BAY_WIDTH'])
+        distances = layout.matrix(stops)
+        path = [0] + [i + 1 for i in s_shape(stops[1:])]
+        if len(zone_picks) >= config['OPTIMIZE_MIN_PICKS']:
+            method = OPTIMIZED
+            path = min(
+                (path, nearest_neighbour(distances)),
+                key=lambda p: path_length(p, distances))
+            path = two_opt(path, distances, deadline)
+        length += float(path_length(path, distances))
+        route.extend(zone_picks[i - 1][2] for i in path[1:])
+
+    return route + unlocated, method, length
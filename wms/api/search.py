@@ -0,0 +1,73 @@
+from django.conf import settings
+
+from .helpers import search_key
+from .models import Order
+
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+WORD_PREFIX = 'word_prefix'
+SUBSTRING = 'substring'
+
+
+def search_settings():
+    config = {
+        'MIN_LENGTH': 2,
+        'SUBSTRING_MIN_LENGTH': 3,
+        'DEFAULT_LIMIT': 10,
+        'MAX_LIMIT': 50,
+        'MAX_AGE': 10,
+    }
+    config.update(getattr(settings, 'ORDER_SEARCH', {}))
+    return config
+
+
+def prefix_upper_bound(prefix):
+    """
+    Returns the smallest string greater than every string that starts with
+    `prefix`.
+    """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def search_orders(query, limit, columns):
+    """
+    Returns the `limit` best orders whose folded customer name matches
+    `query`, as (match, row) tuples of the given `values_list()` columns,
+    which must start with the id.
+
+    Exact matches rank first, then names starting with the query (in name
+    order), names with a word starting with it and names containing it
+    (lowest id first). Each kind is one query that stops as soon as the
+    remaining places are filled, and later kinds only run while places are
+    left. Names are only searched for substrings from SUBSTRING_MIN_LENGTH
+    characters, since short substrings match most of the table.
+    """
+    query = search_key(query)
+    if len(query) < search_settings()['MIN_LENGTH']:
+        return []
+    orders = Order.objects.order_by()
+
+    # The range lets the index serve the prefix scan on every backend
+    rows = orders.filter(
+        customer_name_key__gte=query,
+        customer_name_key__lt=prefix_upper_bound(query),
+        customer_name_key__startswith=query).order_by(
+            'customer_name_key', 'id').values_list(
+                'customer_name_key', *columns)[:limit]
+    results = [
+        (EXACT if key == query else PREFIX, row) for key, *row in rows]
+
+    stages = [(WORD_PREFIX, ' ' + query)]
+    if len(query) >= search_settings()['SUBSTRING_MIN_LENGTH']:
+        stages.append((SUBSTRING, query))
+    found = set()
+    for match, pattern in stages:
+        if len(results) >= limit:
+            break
+        found.update(row[0] for _, row in results)
+        rows = orders.filter(customer_name_key__contains=pattern).exclude(
+            id__in=found).order_by('id').values_list(*columns)[
+                :limit - len(results)]
+        results.extend((match, row) for row in rows)
+    return results
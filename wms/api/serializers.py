@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import SKU, Storage, Order, OrderLine
+from .models import SKU, Storage, Order, OrderLine, Warehouse
 
 
 class SKUSerializer(serializers.ModelSerializer):
@@ -9,19 +9,56 @@ class SKUSerializer(serializers.ModelSerializer):
         fields = ('id', 'product_name',)
 
 
+class WarehouseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Warehouse
+        fields = ('id', 'name',)
+
+
 class StorageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Storage
-        fields = ('id', 'stock', 'sku',)
+        fields = (
+            'id', 'stock', 'sku', 'warehouse', 'zone', 'aisle', 'bay',
+            'level',)
 
 
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ('id', 'customer_name',)
+        fields = (
+            'id', 'customer_name', 'line_count', 'total_units',
+            'distinct_skus',)
 
 
 class OrderLineSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderLine
         fields = ('id', 'sku', 'quantity', 'order',)
+
+
+class ValuesSerializer(object):
+    """
+    Read-only fast path for a ModelSerializer with plain model and primary
+    key fields: fetches `values_list()` rows and zips them with the field
+    names, producing the same output without model instances or per-field
+    serialization.
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        model = serializer_class.Meta.model
+        self.fields = fields or serializer_class.Meta.fields
+        self.columns = tuple(
+            model._meta.get_field(field).attname for field in self.fields)
+
+    def values(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def to_representation(self, rows):
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+    def to_dict(self, instance):
+        return {
+            field: getattr(instance, column)
+            for field, column in zip(self.fields, self.columns)}
@@ -0,0 +1,183 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import mmap
+import os
+import struct
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Storage
+
+
+# File layout: a header of magic, format, row count and build time (in
+# microseconds since the epoch), then three int64 columns of `count` values
+# in native byte order: key (sku << 32 | warehouse, 0 for none), stock and
+# storage id, sorted by key, stock and id.
+MAGIC = b'WMSSTOCK'
+FORMAT = 1
+HEADER = struct.Struct('=8sqqq')
+
+WAREHOUSE_MASK = (1 << 32) - 1
+
+
+def snapshot_settings():
+    config = {
+        'PATH': None,
+        'CHECK_INTERVAL': 1.0,
+        'MAX_AGE': 300,
+        'OVERLAY_MARGIN': 1.0,
+    }
+    config.update(getattr(settings, 'STOCK_SNAPSHOT', {}))
+    return config
+
+
+def build_snapshot(path):
+    """
+    Writes a snapshot of the stock of every storage to `path`, through a
+    temporary file that then replaces it, so that readers only ever open a
+    complete snapshot. Returns the number of storages written.
+    """
+    built_at = timezone.now()
+    keys = array('q')
+    stocks = array('q')
+    ids = array('q')
+    rows = Storage.objects.filter(stock__gt=0).annotate(
+        site=Coalesce('warehouse', 0)).order_by(
+            'sku_id', 'site', 'stock', 'id').values_list(
+                'sku_id', 'site', 'stock', 'id')
+    for sku_id, site, stock, storage_id in rows.iterator(chunk_size=10000):
+        keys.append(sku_id << 32 | site)
+        stocks.append(stock)
+        ids.append(storage_id)
+
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, FORMAT, len(keys),
+            int(built_at.timestamp() * 1000000)))
+        for column in (keys, stocks, ids):
+            column.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return len(keys)
+
+
+class SharedSnapshot(object):
+    """
+    A stock snapshot file mapped read-only into memory. The pages are
+    shared by every process that maps the file, and columns are read in
+    place through memoryviews, without copies.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.identity = self.file_identity(os.fstat(f.fileno()))
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_format, count, built_at = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError("%s is not a stock snapshot" % path)
+        self.count = count
+        self.built_at = datetime.fromtimestamp(
+            built_at / 1000000, timezone.utc)
+        columns = memoryview(self.mmap)[HEADER.size:].cast('q')
+        self.keys = columns[:count]
+        self.stocks = columns[count:2 * count]
+        self.ids = columns[2 * count:3 * count]
+
+    @staticmethod
+    def file_identity(stat):
+        return stat.st_ino, stat.st_mtime_ns
+
+    def rows(self, sku_ids, warehouse=None):
+        """
+        Yields (warehouse_id, sku_id, id, stock) rows of the storages of
+        the given SKUs in the snapshot, optionally in one warehouse only.
+        """
+        for sku_id in sorted(set(sku_ids)):
+            if warehouse is None:
+                start = bisect_left(self.keys, sku_id << 32)
+                end = bisect_left(self.keys, (sku_id + 1) << 32)
+            else:
+                key = sku_id << 32 | warehouse
+                start = bisect_left(self.keys, key)
+                end = bisect_right(self.keys, key)
+            for i in range(start, end):
+                yield ((self.keys[i] & WAREHOUSE_MASK) or None, sku_id,
+                       self.ids[i], self.stocks[i])
+
+    def stock_rows(self, sku_ids, warehouse=None):
+        """
+        Returns the rows of `rows()` brought up to date with the storages
+        written since the snapshot was built, in (warehouse, sku, stock,
+        id) order.
+        """
+        since = self.built_at - timedelta(
+            seconds=snapshot_settings()['OVERLAY_MARGIN'])
+        sku_ids = set(sku_ids)
+        rows = list(self.rows(sku_ids, warehouse))
+        listed = {row[2] for row in rows}
+        # Writes may have moved storages to other SKUs or warehouses, so
+        # the overlay has the storages written since that are of these
+        # SKUs now or were in the snapshot. The (updated_at, id) index
+        # serves the scan, which only grows with the writes since the
+        # snapshot was built
+        overlay = {
+            storage_id: row for storage_id, *row in
+            Storage.all_objects.filter(updated_at__gte=since).values_list(
+                'id', 'warehouse_id', 'sku_id', 'stock', 'deleted_at')
+            if row[1] in sku_ids or storage_id in listed}
+        rows = [row for row in rows if row[2] not in overlay]
+        rows.extend(
+            (site, sku_id, storage_id, stock)
+            for storage_id, (site, sku_id, stock, deleted_at)
+            in overlay.items()
+            if deleted_at is None and stock > 0 and sku_id in sku_ids and
+            (warehouse is None or site == warehouse))
+        rows.sort(key=lambda row: (row[0] or 0, row[1], row[3], row[2]))
+        return rows
+
+
+_shared = None
+_checked_at = None
+
+
+def get_snapshot():
+    """
+    Returns the snapshot at STOCK_SNAPSHOT['PATH'], or None if there is
+    none, it is older than MAX_AGE seconds or snapshots are off. The file
+    is checked for a new version every CHECK_INTERVAL seconds.
+    """
+    global _shared, _checked_at
+    config = snapshot_settings()
+    if not config['PATH']:
+        return None
+    now = time.monotonic()
+    if _checked_at is None or now - _checked_at >= config['CHECK_INTERVAL']:
+        _checked_at = now
+        try:
+            identity = SharedSnapshot.file_identity(os.stat(config['PATH']))
+        except FileNotFoundError:
+            _shared = None
+        else:
+            if _shared is None or _shared.identity != identity:
+                # Readers of the previous version keep their mapping
+                _shared = SharedSnapshot(config['PATH'])
+    if _shared is None or timezone.now() - _shared.built_at > timedelta(
+            seconds=config['MAX_AGE']):
+        return None
+    return _shared
+
+
+@receiver(setting_changed)
+def reset_snapshot(**kwargs):
+    global _shared, _checked_at
+    if kwargs['setting'] == 'STOCK_SNAPSHOT':
+        _shared = None
+        _checked_at = None
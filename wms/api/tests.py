@@ -1,8 +1,35 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
+from contextlib import contextmanager
+from unittest import mock, skipUnless
+import gzip
+import io
 import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unicodedata
 
-from .models import Order, OrderLine, SKU, Storage
+from .models import IdempotencyKey, Order, OrderLine, SKU, Storage, \
+    Tombstone, Warehouse
+from .find_picks import find_picks, find_picks_batch
+from .helpers import LIGATURES, convert_to_ascii, is_ascii
+from . import admission, allocation, changes, db_router, middleware, \
+    profiling, query_budget, renderers, routing, snapshot, views
+from .management.commands import import_data
+
+
+# Aggregates of an order without lines
+NO_LINES = {'line_count': 0, 'total_units': 0, 'distinct_skus': 0}
 
 
 class OrderTestCase(APITestCase):
@@ -33,7 +60,9 @@ class OrderTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(
             response.data,
-            {'id': order.id, 'customer_name': order.customer_name})
+            dict(
+                {'id': order.id, 'customer_name': order.customer_name},
+                **NO_LINES))
 
     def test_update_order(self):
         """
@@ -282,7 +311,10 @@ class StorageTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(
-            response.data, {'id': storage.id, 'stock': 88, 'sku': sku.id})
+            response.data, {
+                'id': storage.id, 'stock': 88, 'sku': sku.id,
+                'warehouse': None, 'zone': '', 'aisle': None, 'bay': None,
+                'level': None})
 
     def test_delete_storage(self):
         """
@@ -661,7 +693,9 @@ class SearchTestCase(APITestCase):
         self.assertEqual(content['count'], 1)
         self.assertEqual(
             content['results'][0],
-            {'id': 1, 'customer_name': 'Test customer 123'})
+            dict(
+                {'id': 1, 'customer_name': 'Test customer 123'},
+                **NO_LINES))
 
     def test_search_no_match(self):
         """
@@ -687,7 +721,9 @@ class SearchTestCase(APITestCase):
         self.assertEqual(content['count'], 1)
         self.assertEqual(
             content['results'][0],
-            {'id': 1, 'customer_name': 'Test customer 123'})
+            dict(
+                {'id': 1, 'customer_name': 'Test customer 123'},
+                **NO_LINES))
 
     def test_search_no_accent_match(self):
         """
@@ -701,7 +737,9 @@ class SearchTestCase(APITestCase):
         self.assertEqual(content['count'], 1)
         self.assertEqual(
             content['results'][0],
-            {'id': 1, 'customer_name': 'Thomas Müller'})
+            dict(
+                {'id': 1, 'customer_name': 'Thomas Müller'},
+                **NO_LINES))
 
     def test_search_with_accent_match(self):
         """
@@ -714,7 +752,10 @@ class SearchTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(content['count'], 1)
         self.assertEqual(
-            content['results'][0], {'id': 1, 'customer_name': 'Thomas Müller'})
+            content['results'][0],
+            dict(
+                {'id': 1, 'customer_name': 'Thomas Müller'},
+                **NO_LINES))
 
     def test_search_with_accent_no_match(self):
         """
@@ -727,3 +768,1738 @@ class SearchTestCase(APITestCase):
         content = json.loads(response.content)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(content['count'], 0)
+
+
+class RankedSearchTestCase(APITestCase):
+
+    def setUp(self):
+        for name in ('Anne Smith', 'Joanna Banks', 'Ann', 'Annabel Lee',
+                     'Dean Annan', 'Ånn Berg'):
+            Order.objects.create(customer_name=name)
+
+    def search(self, query, **params):
+        params['q'] = query
+        response = self.client.get('/api/order/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (row['customer_name'], row['match'])
+            for row in json.loads(response.content)['results']]
+
+    def test_ranking(self):
+        """
+        Ensure exact matches rank before prefixes, word prefixes and
+        substrings, and accents are folded.
+        """
+        self.assertEqual(self.search('ANN'), [
+            ('Ann', 'exact'),
+            ('Ånn Berg', 'prefix'),
+            ('Annabel Lee', 'prefix'),
+            ('Anne Smith', 'prefix'),
+            ('Dean Annan', 'word_prefix'),
+            ('Joanna Banks', 'substring'),
+        ])
+        self.assertEqual(
+            self.search('ann  b'), [('Ånn Berg', 'prefix')])
+
+    def test_top_k(self):
+        """
+        Ensure only the top k matches are returned, and lower ranks aren't
+        searched once k are found.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('ann', k=2), [
+                ('Ann', 'exact'), ('Ånn Berg', 'prefix')])
+        self.assertEqual(self.search('ann', k=5)[-1], (
+            'Dean Annan', 'word_prefix'))
+
+        response = self.client.get('/api/order/search/?q=ann&k=0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/order/search/?q=ann&k=x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_min_length(self):
+        """
+        Ensure short queries return nothing and don't search substrings.
+        """
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('a'), [])
+        self.assertEqual(self.search('an'), [
+            ('Ann', 'prefix'), ('Ånn Berg', 'prefix'),
+            ('Annabel Lee', 'prefix'), ('Anne Smith', 'prefix'),
+            ('Dean Annan', 'word_prefix')])
+
+    def test_fields_and_deleted(self):
+        """
+        Ensure sparse fields apply and deleted orders aren't found.
+        """
+        Order.objects.get(customer_name='Ann').soft_delete()
+        response = self.client.get(
+            '/api/order/search/', {'q': 'ann', 'k': 1, 'fields': 'id'})
+        self.assertEqual(json.loads(response.content)['results'], [
+            {'id': Order.objects.get(customer_name='Ånn Berg').id,
+             'match': 'prefix'}])
+        self.assertIn('max-age', response['Cache-Control'])
+
+
+@skipUnless(allocation.numpy_available(), "NumPy is not installed")
+class AllocationEngineTestCase(APITestCase):
+
+    def setUp(self):
+        random.seed(26)
+        for sku_id in range(1, 6):
+            sku = SKU.objects.create(id=sku_id, product_name=sku_id)
+            for _ in range(random.randint(0, 8)):
+                Storage.objects.create(sku=sku, stock=random.randint(0, 9))
+
+    def random_order(self):
+        return [
+            {'sku': random.randint(1, 5), 'quantity': random.randint(0, 30)}
+            for _ in range(random.randint(1, 4))]
+
+    def find_picks_python(self, order_lines):
+        """
+        Plans with the pure-Python stock used when NumPy isn't installed.
+        """
+        with mock.patch.object(allocation, 'np', None):
+            self.assertFalse(allocation.numpy_available())
+            return find_picks(order_lines)
+
+    def test_matches_python_planner(self):
+        """
+        Ensure the vectorized engine returns the same picks as the
+        pure-Python planner.
+        """
+        for _ in range(200):
+            order_lines = self.random_order()
+            self.assertEqual(
+                find_picks(order_lines), self.find_picks_python(order_lines))
+
+    def test_batch_orders(self):
+        """
+        Ensure a batch of orders is planned as if each order was planned
+        on its own.
+        """
+        orders = [self.random_order() for _ in range(50)]
+        self.assertEqual(
+            find_picks_batch(orders),
+            [find_picks(order_lines) for order_lines in orders])
+
+
+class ReindexCustomerNamesTestCase(APITestCase):
+
+    def setUp(self):
+        # bulk_create bypasses Order.save, leaving the folded names empty
+        Order.objects.bulk_create([
+            Order(id=1, customer_name='Thomas Müller'),
+            Order(id=2, customer_name='Zoë Smith'),
+            Order(id=3, customer_name='Tom Jones')])
+
+    def test_reindex(self):
+        """
+        Ensure reindexing makes bulk-loaded orders searchable.
+        """
+        call_command(
+            'reindex_customer_names', chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list(
+                'customer_name_ascii', flat=True)),
+            ['Thomas Muller', 'Zoe Smith', 'Tom Jones'])
+
+        response = self.client.get('/api/order/?q=muller', format='json')
+        self.assertEqual(json.loads(response.content)['count'], 1)
+        response = self.client.get('/api/order/search/?q=zoe')
+        self.assertEqual(
+            [row['id'] for row in json.loads(response.content)['results']],
+            [2])
+
+    def test_reindex_after_id(self):
+        """
+        Ensure reindexing resumes after the given id.
+        """
+        call_command(
+            'reindex_customer_names', after_id=2, stdout=io.StringIO())
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list(
+                'customer_name_ascii', flat=True)),
+            ['', '', 'Tom Jones'])
+
+    def test_reindex_only_stale(self):
+        """
+        Ensure only stale rows are written with `--only-stale`.
+        """
+        Order.objects.filter(id=3).update(
+            customer_name_ascii='Tom Jones', customer_name_key='tom jones')
+        out = io.StringIO()
+        call_command('reindex_customer_names', only_stale=True, stdout=out)
+        self.assertIn('Reindexed 2 of 3 orders, last id 3.', out.getvalue())
+        self.assertFalse(
+            Order.objects.filter(customer_name_ascii='').exists())
+
+
+class ConvertToAsciiTestCase(TestCase):
+
+    @staticmethod
+    def nfd_fold(string):
+        """
+        Reference implementation: NFD normalization, dropping marks.
+        """
+        return ''.join(
+            c for c in unicodedata.normalize('NFD', string)
+            if unicodedata.category(c) != 'Mn')
+
+    def test_matches_nfd_folding(self):
+        """
+        Ensure folding matches NFD folding for every non-ligature
+        character in the Latin, Greek and Cyrillic blocks.
+        """
+        for code_point in range(0x80, 0x530):
+            char = chr(code_point)
+            if char in LIGATURES:
+                continue
+            self.assertEqual(convert_to_ascii(char), self.nfd_fold(char))
+
+    def test_folds_strings(self):
+        """
+        Ensure whole strings are folded.
+        """
+        self.assertEqual(convert_to_ascii('Thomas Müller'), 'Thomas Muller')
+        self.assertEqual(convert_to_ascii('Zoë Brontë'), 'Zoe Bronte')
+        self.assertEqual(convert_to_ascii('plain ascii'), 'plain ascii')
+
+    def test_folds_ligatures(self):
+        """
+        Ensure letters NFD does not decompose are folded.
+        """
+        self.assertEqual(convert_to_ascii('Straße'), 'Strasse')
+        self.assertEqual(convert_to_ascii('Ærø Łódź'), 'AEro Lodz')
+        self.assertEqual(convert_to_ascii('Søren Œuvre'), 'Soren OEuvre')
+
+    def test_is_ascii(self):
+        """
+        Ensure ASCII detection.
+        """
+        self.assertTrue(is_ascii(''))
+        self.assertTrue(is_ascii('Tom Jones 123'))
+        self.assertFalse(is_ascii('Tom Jönes'))
+
+
+class FoldedSearchTestCase(APITestCase):
+
+    def test_folded_search_with_accent_match(self):
+        """
+        Ensure folded search term with accent matches `customer_name`
+        without accent.
+        """
+        order = Order(customer_name="Tom Jones")
+        order.save()
+        response = self.client.get(
+            '/api/order/?q=jönes&fold=true', {}, format='json')
+        content = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(content['count'], 1)
+        self.assertEqual(
+            content['results'][0],
+            dict(
+                {'id': order.id, 'customer_name': 'Tom Jones'},
+                **NO_LINES))
+
+    def test_folded_search_ligature_match(self):
+        """
+        Ensure folded search matches across ligatures in both directions.
+        """
+        order = Order(customer_name="Johann Strauß")
+        order.save()
+        for query in ('strauss', 'strauß'):
+            response = self.client.get(
+                '/api/order/', {'q': query, 'fold': 'true'}, format='json')
+            content = json.loads(response.content)
+            self.assertEqual(content['count'], 1)
+
+
+class ImportDataTestCase(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_import(self):
+        """
+        Ensure CSV and NDJSON files are imported in dependency order.
+        """
+        skus = self.write('skus.csv', 'id,product_name\n1,Apple\n2,Pear\n')
+        warehouses = self.write('warehouses.csv', 'id,name\n5,North\n')
+        storages = self.write(
+            'storages.csv',
+            'id,sku,stock,warehouse\n1,1,5,5\n2,1,10,\n3,2,7,5\n')
+        orders = self.write(
+            'orders.ndjson', '{"id": 4, "customer_name": "Thomas Müller"}\n')
+        lines = self.write(
+            'lines.jsonl',
+            '{"id": 1, "order": 4, "sku": 2, "quantity": 3}\n')
+        call_command(
+            'import_data', skus=skus, warehouses=warehouses,
+            storages=storages, orders=orders, order_lines=lines,
+            batch_size=2, stdout=io.StringIO())
+
+        self.assertEqual(SKU.objects.count(), 2)
+        self.assertEqual(
+            list(Storage.objects.order_by('id').values_list(
+                'id', 'sku_id', 'stock', 'warehouse_id')),
+            [(1, 1, 5, 5), (2, 1, 10, None), (3, 2, 7, 5)])
+        self.assertEqual(
+            Order.objects.get(id=4).customer_name_ascii, 'Thomas Muller')
+        self.assertEqual(OrderLine.objects.get().order_id, 4)
+        self.assertEqual(
+            Order.objects.values_list(*Order.AGGREGATES).get(id=4),
+            (1, 3, 1))
+
+    def test_copy_values(self):
+        """
+        Ensure empty strings are quoted for COPY, which reads unquoted
+        empty fields as NULL.
+        """
+        self.assertEqual(
+            [import_data.copy_value(value)
+             for value in (1, '', None, 'Say "hi"')],
+            ['1', '""', '', '"Say ""hi"""'])
+
+    def test_import_unknown_foreign_key(self):
+        """
+        Ensure rows referencing unknown ids are rejected.
+        """
+        SKU.objects.create(id=1, product_name='Apple')
+        storages = self.write('storages.csv', 'id,sku,stock\n1,1,5\n2,9,1\n')
+        with self.assertRaisesMessage(
+                CommandError, 'storages.csv, line 3: sku 9 does not exist'):
+            call_command('import_data', storages=storages,
+                         stdout=io.StringIO())
+        storages = self.write(
+            'storages.ndjson', '{"id": 3, "sku": 1, "stock": 1, '
+            '"warehouse": 2}\n')
+        with self.assertRaisesMessage(
+                CommandError, 'line 1: warehouse 2 does not exist'):
+            call_command('import_data', storages=storages,
+                         stdout=io.StringIO())
+
+    def test_import_duplicate_id(self):
+        """
+        Ensure ids already in the database or the file are rejected.
+        """
+        SKU.objects.create(id=1, product_name='Apple')
+        skus = self.write('skus.csv', 'id,product_name\n1,Pear\n')
+        with self.assertRaisesMessage(CommandError, 'duplicate id 1'):
+            call_command('import_data', skus=skus, stdout=io.StringIO())
+        storages = self.write(
+            'storages.csv', 'id,sku,stock\n1,1,5\n2,1,1\n3,1,4\n1,1,2\n')
+        # Batches with duplicate storage ids fail to insert
+        with self.assertRaisesMessage(
+                CommandError, 'storages.csv, lines 4-5: UNIQUE constraint'):
+            call_command(
+                'import_data', storages=storages, batch_size=2,
+                stdout=io.StringIO())
+        self.assertEqual(Storage.objects.count(), 2)
+
+    def test_import_malformed_line(self):
+        """
+        Ensure lines that aren't valid JSON are reported with their line.
+        """
+        SKU.objects.create(id=1, product_name='Apple')
+        storages = self.write(
+            'storages.ndjson',
+            '{"id": 1, "sku": 1, "stock": 5}\n{"id": 2, "sku": 1,\n')
+        with self.assertRaisesMessage(
+                CommandError, 'storages.ndjson, line 2: Expecting'):
+            call_command(
+                'import_data', storages=storages, stdout=io.StringIO())
+
+
+class FastListTestCase(APITestCase):
+
+    def setUp(self):
+        for i in range(1, 4):
+            sku = SKU.objects.create(product_name='Product %s' % i)
+            order = Order.objects.create(customer_name='Zoë %s' % i)
+            Storage.objects.create(sku=sku, stock=i * 10)
+            OrderLine.objects.create(sku=sku, order=order, quantity=i)
+
+    def test_fast_list_matches_serializer(self):
+        """
+        Ensure list responses are identical with and without the fast path.
+        """
+        for url in ('/api/sku/', '/api/storage/', '/api/order/',
+                    '/api/orderline/', '/api/order/?q=zoe&page_size=2'):
+            fast = self.client.get(url, format='json')
+            with mock.patch.object(views.FastListMixin, 'fast_list', False):
+                full = self.client.get(url, format='json')
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, full.content)
+
+    def test_page_size(self):
+        """
+        Ensure clients can ask for larger pages.
+        """
+        response = self.client.get(
+            '/api/storage/', {'page_size': 2}, format='json')
+        content = json.loads(response.content)
+        self.assertEqual(content['count'], 3)
+        self.assertEqual(len(content['results']), 2)
+        self.assertEqual(
+            content['results'][0], {
+                'id': 1, 'stock': 10, 'sku': 1, 'warehouse': None,
+                'zone': '', 'aisle': None, 'bay': None, 'level': None})
+
+
+class ListFilterTestCase(APITestCase):
+
+    def setUp(self):
+        self.skus = [SKU.objects.create(product_name=i) for i in range(3)]
+        self.orders = [
+            Order.objects.create(customer_name=str(i)) for i in range(3)]
+        for i, sku in enumerate(self.skus):
+            for stock in (0, 5, 10):
+                Storage.objects.create(sku=sku, stock=stock + i)
+            OrderLine.objects.create(
+                sku=sku, order=self.orders[i], quantity=1)
+            OrderLine.objects.create(
+                sku=sku, order=self.orders[0], quantity=2)
+
+    def ids(self, url, params):
+        response = self.client.get(url, params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [r['id'] for r in json.loads(response.content)['results']]
+
+    def test_filter_storages(self):
+        """
+        Ensure storages can be filtered by SKU and stock.
+        """
+        sku = self.skus[1]
+        self.assertEqual(
+            self.ids('/api/storage/', {'sku': sku.id}),
+            list(Storage.objects.filter(sku=sku).values_list(
+                'id', flat=True)))
+        self.assertEqual(
+            self.ids('/api/storage/', {
+                'sku__in': '%s,%s' % (self.skus[0].id, self.skus[2].id),
+                'stock__gte': 5, 'stock__lt': 12}),
+            list(Storage.objects.filter(
+                sku__in=[self.skus[0], self.skus[2]],
+                stock__gte=5, stock__lt=12).values_list('id', flat=True)))
+
+    def test_filter_order_lines(self):
+        """
+        Ensure order lines can be filtered by order.
+        """
+        order = self.orders[0]
+        self.assertEqual(
+            self.ids('/api/orderline/', {'order': order.id}),
+            list(order.orderline_set.values_list('id', flat=True)))
+        self.assertEqual(
+            len(self.ids('/api/orderline/', {'order__in': '%s,%s' % (
+                self.orders[1].id, self.orders[2].id)})), 2)
+
+    def test_invalid_filter(self):
+        """
+        Ensure invalid filter values are rejected.
+        """
+        response = self.client.get(
+            '/api/storage/', {'sku': 'abc', 'stock__gte': -1}, format='json')
+        content = json.loads(response.content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(content), {'sku', 'stock__gte'})
+
+
+class SparseFieldsTestCase(APITestCase):
+
+    def setUp(self):
+        self.sku = SKU.objects.create(product_name='Test Product 123')
+        for stock in (5, 8):
+            Storage.objects.create(sku=self.sku, stock=stock)
+
+    def test_list_fields(self):
+        """
+        Ensure list responses only contain the requested fields.
+        """
+        for fast_list in (True, False):
+            with mock.patch.object(
+                    views.FastListMixin, 'fast_list', fast_list):
+                response = self.client.get(
+                    '/api/storage/', {'fields': 'stock,id'}, format='json')
+            content = json.loads(response.content)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                content['results'],
+                [{'id': 1, 'stock': 5}, {'id': 2, 'stock': 8}])
+
+    def test_retrieve_fields(self):
+        """
+        Ensure retrieve responses only contain the requested fields.
+        """
+        response = self.client.get(
+            '/api/sku/%s/' % self.sku.id, {'fields': 'product_name'},
+            format='json')
+        self.assertEqual(
+            json.loads(response.content),
+            {'product_name': 'Test Product 123'})
+
+    def test_unknown_fields(self):
+        """
+        Ensure unknown fields are rejected.
+        """
+        response = self.client.get(
+            '/api/storage/', {'fields': 'id,price'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', json.loads(response.content))
+
+    def test_columnar_format(self):
+        """
+        Ensure lists can be rendered as columnar JSON.
+        """
+        response = self.client.get(
+            '/api/storage/', HTTP_ACCEPT='application/vnd.wms.columnar+json')
+        content = json.loads(response.content)
+        self.assertEqual(
+            response['Content-Type'], 'application/vnd.wms.columnar+json')
+        self.assertEqual(content['count'], 2)
+        self.assertEqual(
+            content['results'],
+            {'id': [1, 2], 'stock': [5, 8], 'sku': [self.sku.id] * 2,
+             'warehouse': [None] * 2, 'zone': [''] * 2, 'aisle': [None] * 2,
+             'bay': [None] * 2, 'level': [None] * 2})
+
+    @skipUnless(renderers.msgpack, "msgpack is not installed")
+    def test_msgpack_format(self):
+        """
+        Ensure responses can be rendered as MessagePack.
+        """
+        response = self.client.get(
+            '/api/storage/', {'fields': 'id'},
+            HTTP_ACCEPT='application/x-msgpack')
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        self.assertEqual(
+            renderers.msgpack.unpackb(response.content, raw=False),
+            {'count': 2, 'next': None, 'previous': None,
+             'results': [{'id': 1}, {'id': 2}]})
+
+
+class CompressionTestCase(APITestCase):
+
+    def setUp(self):
+        sku = SKU.objects.create(product_name='Test Product 123')
+        Storage.objects.bulk_create(
+            [Storage(sku=sku, stock=i) for i in range(200)])
+
+    def test_gzip_list(self):
+        """
+        Ensure large responses are gzipped when the client accepts it.
+        """
+        plain = self.client.get('/api/storage/', {'page_size': 200})
+        response = self.client.get(
+            '/api/storage/', {'page_size': 200},
+            HTTP_ACCEPT_ENCODING='gzip;q=1.0, identity;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_small_response_not_compressed(self):
+        """
+        Ensure responses below the size threshold are not compressed.
+        """
+        response = self.client.get(
+            '/api/storage/', {'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_refused_encoding(self):
+        """
+        Ensure codings with q=0 are not used.
+        """
+        response = self.client.get(
+            '/api/storage/', {'page_size': 200},
+            HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_preferred_encoding(self):
+        """
+        Ensure the best available encoding is chosen.
+        """
+        self.assertIs(
+            middleware.choose_encoder('gzip, br, zstd'),
+            middleware.ENCODERS[0])
+        self.assertIs(
+            middleware.choose_encoder('deflate, gzip'),
+            middleware.GzipEncoder)
+        self.assertIsNone(middleware.choose_encoder('deflate'))
+
+    def test_streaming_response(self):
+        """
+        Ensure streaming responses are compressed chunk by chunk.
+        """
+        chunks = [b'{"picks": [', b'{"id": 1, "quantity": 5}, ' * 100, b']}']
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        response = middleware.CompressionMiddleware().process_response(
+            request, StreamingHttpResponse(iter(chunks)))
+        compressed = list(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertGreater(len(compressed), 1)
+        self.assertEqual(
+            gzip.decompress(b''.join(compressed)), b''.join(chunks))
+
+
+class AdmissionControlTestCase(APITestCase):
+
+    def test_queue_and_fairness(self):
+        """
+        Ensure waiting requests are admitted round-robin across clients.
+        """
+        controller = admission.AdmissionController(
+            max_concurrent=1, max_queue=10, max_queue_per_client=2,
+            max_wait=5)
+        self.assertEqual(controller.acquire('a'), admission.ADMITTED)
+
+        admitted = []
+
+        def request(client):
+            if controller.acquire(client) == admission.ADMITTED:
+                admitted.append(client)
+                controller.release()
+
+        threads = []
+        for client in ('a', 'a', 'b'):
+            threads.append(threading.Thread(target=request, args=(client,)))
+            threads[-1].start()
+            while controller.stats()['queued'] < len(threads):
+                time.sleep(0.001)
+
+        # A third request from `a` exceeds its share of the queue
+        self.assertEqual(controller.acquire('a'), admission.CLIENT_LIMIT)
+
+        controller.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted, ['a', 'b', 'a'])
+
+        stats = controller.stats()
+        self.assertEqual(stats['admitted'], 4)
+        self.assertEqual(stats['client_limit'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['queued'], 0)
+
+    def test_queue_full(self):
+        """
+        Ensure requests are rejected once the queue is full.
+        """
+        controller = admission.AdmissionController(
+            max_concurrent=1, max_queue=0, max_queue_per_client=1,
+            max_wait=5)
+        self.assertEqual(controller.acquire('a'), admission.ADMITTED)
+        self.assertEqual(controller.acquire('b'), admission.QUEUE_FULL)
+
+    def test_wait_timeout(self):
+        """
+        Ensure queued requests give up after the maximum wait.
+        """
+        controller = admission.AdmissionController(
+            max_concurrent=1, max_queue=1, max_queue_per_client=1,
+            max_wait=0.01)
+        self.assertEqual(controller.acquire('a'), admission.ADMITTED)
+        self.assertEqual(controller.acquire('b'), admission.TIMED_OUT)
+        self.assertEqual(controller.stats()['queued'], 0)
+
+    @override_settings(FULFILLMENT_ADMISSION={
+        'MAX_CONCURRENT': 1, 'MAX_QUEUE': 0, 'RETRY_AFTER': 3})
+    def test_fulfillment_rejected(self):
+        """
+        Ensure fulfillment answers 503 with Retry-After when overloaded.
+        """
+        controller = admission.get_controller()
+        controller.acquire('other')
+        try:
+            response = self.client.post(
+                '/api/fulfillment/',
+                {'lines': [{'sku': 1, 'quantity': 2}]}, format='json')
+        finally:
+            controller.release()
+        content = json.loads(response.content)
+        self.assertEqual(
+            response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(content['error']['code'], 13)
+
+        response = self.client.get('/api/metrics/')
+        metrics = json.loads(response.content)['fulfillment_admission']
+        self.assertEqual(metrics['queue_full'], 1)
+        self.assertEqual(metrics['in_flight'], 0)
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaRoutingTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.sku = SKU.objects.create(product_name='Test Product 123')
+        patcher = mock.patch.object(
+            db_router, 'choose_replica', wraps=db_router.choose_replica)
+        self.choose_replica = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_use_replica(self):
+        """
+        Ensure list, retrieve and fulfillment reads go to a replica.
+        """
+        self.client.get('/api/sku/')
+        self.client.get('/api/sku/%s/' % self.sku.id)
+        self.client.post(
+            '/api/fulfillment/',
+            {'lines': [{'sku': self.sku.id, 'quantity': 1}]}, format='json')
+        self.assertGreaterEqual(self.choose_replica.call_count, 3)
+
+    def test_writes_use_primary(self):
+        """
+        Ensure writes and the writing client's next reads use the primary.
+        """
+        response = self.client.post(
+            '/api/storage/', {'sku': self.sku.id, 'stock': 3},
+            format='json', HTTP_X_CLIENT_ID='writer')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.choose_replica.call_count, 0)
+
+        self.client.get('/api/storage/', HTTP_X_CLIENT_ID='writer')
+        self.assertEqual(self.choose_replica.call_count, 0)
+
+        self.client.get('/api/storage/', HTTP_X_CLIENT_ID='reader')
+        self.assertGreater(self.choose_replica.call_count, 0)
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=0.01)
+    def test_pin_expires(self):
+        """
+        Ensure clients read from replicas again after the pin expires.
+        """
+        self.client.delete(
+            '/api/sku/%s/' % self.sku.id, HTTP_X_CLIENT_ID='writer')
+        time.sleep(0.02)
+        self.client.get('/api/sku/', HTTP_X_CLIENT_ID='writer')
+        self.assertGreater(self.choose_replica.call_count, 0)
+
+    def test_router(self):
+        """
+        Ensure the router only uses replicas inside replica_reads().
+        """
+        router = db_router.ReplicaRouter()
+        request = RequestFactory().get('/')
+        with override_settings(DATABASE_REPLICAS=['replica']):
+            self.assertEqual(router.db_for_read(SKU), 'default')
+            with db_router.replica_reads(request):
+                self.assertEqual(router.db_for_read(SKU), 'replica')
+                self.assertEqual(router.db_for_write(SKU), 'default')
+            self.assertEqual(router.db_for_read(SKU), 'default')
+
+
+class ChangeFeedTestCase(TestCase):
+
+    def test_read_after_cursor(self):
+        """
+        Ensure readers get the changes after their cursor.
+        """
+        feed = changes.ChangeFeed(size=10)
+        start = feed.cursor()
+        feed.publish({'id': 1})
+        feed.publish({'id': 2})
+        events, cursor, reset = feed.read(start, timeout=0)
+        self.assertEqual([e['id'] for e in events], [1, 2])
+        self.assertFalse(reset)
+
+        feed.publish({'id': 3})
+        events, cursor, reset = feed.read(cursor, timeout=0)
+        self.assertEqual([e['id'] for e in events], [3])
+        self.assertEqual(feed.read(cursor, timeout=0)[0], [])
+
+    def test_gap_resets(self):
+        """
+        Ensure cursors older than the buffer or from another feed reset.
+        """
+        feed = changes.ChangeFeed(size=2)
+        start = feed.cursor()
+        for i in range(3):
+            feed.publish({'id': i})
+        events, cursor, reset = feed.read(start, timeout=0)
+        self.assertTrue(reset)
+        self.assertEqual(events, [])
+        self.assertEqual(cursor, feed.cursor())
+
+        other = changes.ChangeFeed(size=2)
+        self.assertTrue(other.read(cursor, timeout=0)[2])
+
+    def test_wait_for_change(self):
+        """
+        Ensure readers are woken up by new changes.
+        """
+        feed = changes.ChangeFeed(size=10)
+        threading.Timer(0.01, feed.publish, ({'id': 1},)).start()
+        events, cursor, reset = feed.read(None, timeout=5)
+        self.assertEqual([e['id'] for e in events], [1])
+
+
+@override_settings(CHANGE_FEED={
+    'HEARTBEAT': 0.01, 'MAX_STREAM_SECONDS': 0.05, 'MAX_WAIT': 1})
+class ChangeFeedEndpointTestCase(APITransactionTestCase):
+
+    def test_long_poll(self):
+        """
+        Ensure the long-poll returns committed storage changes.
+        """
+        cursor = self.client.get('/api/changes/', {'wait': 0}).json()[
+            'cursor']
+        sku = SKU.objects.create(product_name='Test Product 123')
+        response = self.client.post(
+            '/api/storage/', {'sku': sku.id, 'stock': 7}, format='json')
+        storage_id = response.json()['id']
+
+        content = self.client.get(
+            '/api/changes/', {'cursor': cursor, 'wait': 0}).json()
+        self.assertFalse(content['reset'])
+        self.assertEqual(
+            [(e['model'], e['action'], e['id']) for e in content['events']],
+            [('sku', 'saved', sku.id), ('storage', 'saved', storage_id)])
+        self.assertEqual(
+            content['events'][1]['data'], {
+                'id': storage_id, 'stock': 7, 'sku': sku.id,
+                'warehouse': None, 'zone': '', 'aisle': None, 'bay': None,
+                'level': None})
+
+        self.client.delete('/api/storage/%s/' % storage_id)
+        content = self.client.get(
+            '/api/changes/', {'cursor': content['cursor'], 'wait': 0}).json()
+        self.assertEqual(
+            [(e['model'], e['action']) for e in content['events']],
+            [('storage', 'deleted')])
+
+    def test_bad_wait(self):
+        """
+        Ensure long-polls with a wait that isn't a finite number fail.
+        """
+        for wait in ('soon', 'nan', 'inf'):
+            response = self.client.get('/api/changes/', {'wait': wait})
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json()['error']['code'], 14)
+
+    def test_event_stream(self):
+        """
+        Ensure changes are streamed as server-sent events.
+        """
+        cursor = changes.feed.cursor()
+        sku = SKU.objects.create(product_name='Test Product 123')
+        response = self.client.get(
+            '/api/changes/', HTTP_ACCEPT='text/event-stream',
+            HTTP_LAST_EVENT_ID=cursor)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn(
+            'id: %s\nevent: change\n' % changes.feed.cursor(), body)
+        self.assertIn('"id": %s' % sku.id, body)
+        self.assertIn(': keepalive', body)
+
+
+class DeltaSyncTestCase(APITestCase):
+
+    def sync(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)
+
+    def test_updated_since(self):
+        """
+        Ensure only rows updated since the cursor are returned, in keyset
+        order, across pages.
+        """
+        skus = [SKU.objects.create(product_name=i) for i in range(5)]
+        started = timezone.now()
+        for sku in skus[:3]:
+            sku.product_name = 'changed'
+            sku.save()
+        SKU.objects.filter(id=skus[4].id).update(updated_at=started)
+
+        content = self.sync('/api/sku/', {
+            'updated_since': started.isoformat(), 'page_size': 2})
+        self.assertEqual(
+            [r['id'] for r in content['results']],
+            [skus[4].id, skus[0].id])
+        self.assertIn('updated_at', content['results'][0])
+
+        content = self.client.get(content['next']).json()
+        self.assertEqual(
+            [r['id'] for r in content['results']],
+            [skus[1].id, skus[2].id])
+        self.assertIsNone(content['next'])
+
+        # Resuming from the last cursor returns nothing new
+        content = self.sync('/api/sku/', content['cursor'])
+        self.assertEqual(content['results'], [])
+
+    def test_deleted_rows(self):
+        """
+        Ensure rows deleted since the cursor are reported.
+        """
+        sku = SKU.objects.create(product_name='Test Product 123')
+        storages = [Storage.objects.create(sku=sku, stock=i) for i in (1, 2)]
+        since = timezone.now().isoformat()
+        response = self.client.delete('/api/storage/%s/' % storages[0].id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        content = self.sync('/api/storage/', {'updated_since': since})
+        self.assertEqual(content['results'], [])
+        self.assertEqual(content['deleted'], [storages[0].id])
+        self.assertEqual(
+            self.sync('/api/sku/', {'updated_since': since})['deleted'], [])
+
+    def test_invalid_cursor(self):
+        """
+        Ensure invalid cursors are rejected.
+        """
+        response = self.client.get(
+            '/api/order/', {'updated_since': 'yesterday', 'after_id': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            set(json.loads(response.content)), {'updated_since', 'after_id'})
+
+
+class SoftDeleteTestCase(APITestCase):
+
+    def setUp(self):
+        self.sku = SKU.objects.create(product_name='Test Product 123')
+        self.storage = Storage.objects.create(sku=self.sku, stock=5)
+        self.order = Order.objects.create(customer_name='Test Customer')
+        self.line = OrderLine.objects.create(
+            order=self.order, sku=self.sku, quantity=2)
+
+    def test_referenced_rows(self):
+        """
+        Ensure referenced rows can be deleted, and take their dependent
+        rows with them.
+        """
+        response = self.client.delete('/api/sku/%s/' % self.sku.id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete('/api/order/%s/' % self.order.id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        for model in (SKU, Storage, Order, OrderLine):
+            self.assertEqual(model.objects.count(), 0)
+            self.assertEqual(model.all_objects.count(), 1)
+        response = self.client.get('/api/storage/%s/' % self.storage.id)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            Tombstone.objects.filter(model='orderline').count(), 1)
+
+    def test_bulk_cascade(self):
+        """
+        Ensure dependent rows are deleted in bulk, with their tombstones
+        and the aggregates of their orders.
+        """
+        for quantity in range(1, 4):
+            OrderLine.objects.create(
+                order=self.order, sku=self.sku, quantity=quantity)
+        # A savepoint around the lines, their update, aggregates and
+        # tombstones, and the order and its tombstone
+        with self.assertNumQueries(8):
+            self.order.soft_delete()
+        self.assertEqual(OrderLine.objects.count(), 0)
+        self.assertEqual(
+            Tombstone.objects.filter(model='orderline').count(), 4)
+        self.assertEqual(
+            Order.all_objects.filter(id=self.order.id).values_list(
+                *Order.AGGREGATES).get(), (0, 0, 0))
+
+    def test_fulfillment_ignores_deleted_rows(self):
+        """
+        Ensure stock of deleted storages isn't picked.
+        """
+        other = Storage.objects.create(sku=self.sku, stock=3)
+        self.storage.soft_delete()
+        response = self.client.post('/api/fulfillment/', {
+            'lines': [{'sku': self.sku.id, 'quantity': 5}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content)['error']['code'], 11)
+
+        response = self.client.post('/api/fulfillment/', {
+            'lines': [{'sku': self.sku.id, 'quantity': 3}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(response.content)['picks'],
+            [{'id': other.id, 'quantity': 3}])
+
+    def test_purge(self):
+        """
+        Ensure only rows deleted before the retention period are purged,
+        and rows still referenced are kept.
+        """
+        self.line.soft_delete()
+        self.sku.soft_delete()
+        recent = Order.objects.create(customer_name='Recent')
+        recent.soft_delete()
+        old = timezone.now() - timezone.timedelta(days=31)
+        for model in (SKU, Storage, OrderLine):
+            model.all_objects.update(deleted_at=old)
+        Tombstone.objects.update(deleted_at=old)
+        Tombstone.objects.create(model='order', object_id=recent.id)
+
+        call_command(
+            'purge_deleted', days=30, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(SKU.all_objects.count(), 0)
+        self.assertEqual(Storage.all_objects.count(), 0)
+        self.assertEqual(OrderLine.all_objects.count(), 0)
+        self.assertEqual(
+            list(Order.all_objects.values_list('id', flat=True)),
+            [self.order.id, recent.id])
+        self.assertEqual(
+            list(Tombstone.objects.values_list('object_id', flat=True)),
+            [recent.id])
+
+
+class MultiGetTestCase(APITestCase):
+
+    def setUp(self):
+        sku = SKU.objects.create(product_name='Test Product 123')
+        self.storages = [
+            Storage.objects.create(sku=sku, stock=i) for i in range(5)]
+
+    def test_ids_query(self):
+        """
+        Ensure rows are returned in request order, with missing ids.
+        """
+        ids = [self.storages[3].id, self.storages[0].id, 999]
+        response = self.client.get(
+            '/api/storage/', {'ids': ','.join(map(str, ids)),
+                              'fields': 'id,stock'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {
+            'results': [
+                {'id': ids[0], 'stock': 3}, {'id': ids[1], 'stock': 0}],
+            'missing': [999],
+        })
+
+    def test_post(self):
+        """
+        Ensure ids can be posted, and deleted rows are reported missing.
+        """
+        self.storages[1].soft_delete()
+        ids = [s.id for s in reversed(self.storages)]
+        response = self.client.post(
+            '/api/storage/multi-get/?fields=id', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {
+            'results': [{'id': i} for i in ids if i != self.storages[1].id],
+            'missing': [self.storages[1].id],
+        })
+
+    def test_invalid_ids(self):
+        """
+        Ensure invalid or too many ids are rejected.
+        """
+        for params in ({'ids': '1,x'}, {'ids': ''}):
+            response = self.client.get('/api/sku/', params)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+        for data in ({'ids': '1,2'}, {'ids': list(range(1, 1002))}, {}):
+            response = self.client.post(
+                '/api/sku/multi-get/', data, format='json')
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WarehouseFulfillmentTestCase(APITestCase):
+
+    def setUp(self):
+        self.skus = [SKU.objects.create(product_name=i) for i in range(3)]
+        self.north = Warehouse.objects.create(name='North')
+        self.south = Warehouse.objects.create(name='South')
+
+    def storage(self, warehouse, sku, stock):
+        return Storage.objects.create(
+            warehouse=warehouse, sku=self.skus[sku], stock=stock).id
+
+    def fulfil(self, lines, **params):
+        params['lines'] = [
+            {'sku': self.skus[sku].id, 'quantity': quantity}
+            for sku, quantity in lines]
+        return self.client.post('/api/fulfillment/', params, format='json')
+
+    def test_preferred_warehouse(self):
+        """
+        Ensure orders are picked in the preferred warehouse when it holds
+        enough stock, even if another has storages with less stock.
+        """
+        self.storage(self.north, 0, 2)
+        south = self.storage(self.south, 0, 10)
+        response = self.fulfil([(0, 3)], warehouse=self.south.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(response.content)['picks'],
+            [{'id': south, 'quantity': 3}])
+
+    def test_fewest_splits(self):
+        """
+        Ensure lines aren't split across warehouses when a single warehouse
+        holds enough stock, and split lines use the largest stocks.
+        """
+        north = [self.storage(self.north, sku, 5) for sku in (0, 1)]
+        south = [self.storage(self.south, sku, 5) for sku in (1, 2)]
+        small = self.storage(None, 2, 1)
+        # Neither warehouse holds all three SKUs, and no line fits in one
+        # storage of the preferred warehouse
+        response = self.fulfil(
+            [(0, 4), (1, 4), (2, 6)], warehouse=self.north.id)
+        self.assertEqual(
+            json.loads(response.content)['picks'], [
+                {'id': north[0], 'quantity': 4},
+                {'id': north[1], 'quantity': 4},
+                {'id': south[1], 'quantity': 5},
+                {'id': small, 'quantity': 1},
+            ])
+
+        response = self.fulfil([(1, 4), (2, 4)])
+        self.assertEqual(
+            json.loads(response.content)['picks'], [
+                {'id': south[0], 'quantity': 4},
+                {'id': south[1], 'quantity': 4},
+            ])
+
+        response = self.fulfil([(2, 7)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_warehouse(self):
+        """
+        Ensure fulfillment fails if the preferred warehouse doesn't exist.
+        """
+        response = self.fulfil([(0, 1)], warehouse=999)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content)['error']['code'], 15)
+
+    def test_without_numpy(self):
+        """
+        Ensure the pure-Python planner partitions by warehouse too.
+        """
+        self.storage(self.north, 0, 1)
+        self.storage(self.north, 0, 1)
+        south = self.storage(self.south, 0, 3)
+        for available in (True, False):
+            with mock.patch.object(
+                    allocation, 'numpy_available', lambda: available):
+                self.assertEqual(
+                    find_picks([{'sku': self.skus[0].id, 'quantity': 3}]),
+                    (True, [{'id': south, 'quantity': 3}]))
+
+
+class StockSnapshotTestCase(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'stock.snapshot')
+        self.skus = [SKU.objects.create(product_name=i) for i in range(2)]
+        self.north = Warehouse.objects.create(name='North')
+        self.storages = [
+            Storage.objects.create(sku=self.skus[0], stock=stock)
+            for stock in (2, 5)] + [
+            Storage.objects.create(
+                sku=self.skus[1], warehouse=self.north, stock=4)]
+        settings = override_settings(STOCK_SNAPSHOT={
+            'PATH': self.path, 'CHECK_INTERVAL': 0, 'OVERLAY_MARGIN': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertSamePicks(self, lines, warehouse=None):
+        self.assertIsNotNone(snapshot.get_snapshot())
+        picks = find_picks(lines, warehouse)
+        with override_settings(STOCK_SNAPSHOT={}):
+            self.assertEqual(picks, find_picks(lines, warehouse))
+        return picks
+
+    def test_snapshot(self):
+        """
+        Ensure plans from the snapshot match plans from the database.
+        """
+        call_command('build_stock_snapshot', stdout=io.StringIO())
+        shared = snapshot.get_snapshot()
+        self.assertEqual(
+            list(shared.rows([self.skus[0].id, self.skus[1].id])), [
+                (None, self.skus[0].id, self.storages[0].id, 2),
+                (None, self.skus[0].id, self.storages[1].id, 5),
+                (self.north.id, self.skus[1].id, self.storages[2].id, 4)])
+        picks = self.assertSamePicks([
+            {'sku': self.skus[0].id, 'quantity': 6},
+            {'sku': self.skus[1].id, 'quantity': 4}])
+        self.assertEqual(picks, (True, [
+            {'id': self.storages[0].id, 'quantity': 2},
+            {'id': self.storages[1].id, 'quantity': 4},
+            {'id': self.storages[2].id, 'quantity': 4}]))
+        self.assertSamePicks(
+            [{'sku': self.skus[1].id, 'quantity': 4}], self.north.id)
+
+    def test_overlay(self):
+        """
+        Ensure storages saved after the snapshot was built override it.
+        """
+        call_command('build_stock_snapshot', stdout=io.StringIO())
+        time.sleep(0.01)
+        self.storages[0].stock = 9
+        self.storages[0].save()
+        self.storages[1].soft_delete()
+        self.storages[2].sku = self.skus[0]
+        self.storages[2].save()
+        added = Storage.objects.create(sku=self.skus[1], stock=1)
+
+        lines = [{'sku': self.skus[0].id, 'quantity': 12}]
+        self.assertEqual(self.assertSamePicks(lines), (True, [
+            {'id': self.storages[0].id, 'quantity': 9},
+            {'id': self.storages[2].id, 'quantity': 3}]))
+        self.assertEqual(
+            self.assertSamePicks([{'sku': self.skus[1].id, 'quantity': 1}]),
+            (True, [{'id': added.id, 'quantity': 1}]))
+
+    def test_new_version(self):
+        """
+        Ensure workers switch to a rebuilt snapshot, and ignore stale or
+        missing ones.
+        """
+        self.assertIsNone(snapshot.get_snapshot())
+        call_command('build_stock_snapshot', stdout=io.StringIO())
+        first = snapshot.get_snapshot()
+        call_command('build_stock_snapshot', stdout=io.StringIO())
+        self.assertIsNot(snapshot.get_snapshot(), first)
+
+        with override_settings(STOCK_SNAPSHOT={
+                'PATH': self.path, 'CHECK_INTERVAL': 0, 'MAX_AGE': -1}):
+            self.assertIsNone(snapshot.get_snapshot())
+
+    def test_no_path(self):
+        """
+        Ensure the command fails without a snapshot path.
+        """
+        with override_settings(STOCK_SNAPSHOT={}):
+            with self.assertRaisesMessage(CommandError, 'No snapshot path'):
+                call_command('build_stock_snapshot', stdout=io.StringIO())
+
+
+class ProfilingTestCase(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sku = SKU.objects.create(product_name='Apple')
+        Storage.objects.create(sku=self.sku, stock=5)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def profile_settings(self, **config):
+        config.setdefault('DIRECTORY', self.directory.name)
+        config.setdefault('TOKEN', 'secret')
+        return override_settings(PROFILING=config)
+
+    def fulfil(self, **headers):
+        return self.client.post(
+            '/api/fulfillment/',
+            {'lines': [{'sku': self.sku.id, 'quantity': 1}]}, format='json',
+            **headers)
+
+    def test_profile_on_demand(self):
+        """
+        Ensure flagged requests are profiled and tagged with their view,
+        latency and query count.
+        """
+        with self.profile_settings():
+            self.assertNotIn('X-Profile', self.fulfil())
+            response = self.fulfil(HTTP_X_PROFILE='secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get('/api/order/?profile=secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 2)
+        match = profiling.PROFILE_NAME.match(profiles[0])
+        self.assertEqual(match['view'], 'fulfil_order')
+        self.assertGreater(int(match['queries']), 0)
+        self.assertEqual(
+            profiling.PROFILE_NAME.match(profiles[1])['view'],
+            'OrderViewSet.list')
+        self.assertEqual(response['X-Profile'], profiles[1])
+
+    def test_disabled(self):
+        """
+        Ensure nothing is profiled without a directory or the token, and
+        flags are ignored without a token.
+        """
+        with self.profile_settings(DIRECTORY=None):
+            self.assertNotIn(
+                'X-Profile', self.fulfil(HTTP_X_PROFILE='secret'))
+        with self.profile_settings(TOKEN=None):
+            self.fulfil(HTTP_X_PROFILE='1')
+            self.client.get('/api/order/?profile=true')
+        with self.profile_settings():
+            self.fulfil(HTTP_X_PROFILE='1')
+            self.assertEqual(self.profiles(), [])
+            self.fulfil(HTTP_X_PROFILE='secret')
+        self.assertEqual(len(self.profiles()), 1)
+
+    def test_sampling_and_rotation(self):
+        """
+        Ensure sampled requests are profiled and only the newest MAX_FILES
+        profiles are kept.
+        """
+        with self.profile_settings(SAMPLE_RATE=1.0, MAX_FILES=2):
+            names = [self.fulfil()['X-Profile'] for _ in range(3)]
+        self.assertEqual(self.profiles(), names[1:])
+        with self.profile_settings(SAMPLE_RATE=1.0, MAX_FILES=0):
+            self.fulfil()
+        self.assertEqual(self.profiles(), [])
+
+    def test_report(self):
+        """
+        Ensure the report summarizes profiles per view and lists the top
+        functions.
+        """
+        with self.profile_settings():
+            self.fulfil(HTTP_X_PROFILE='secret')
+            self.fulfil(HTTP_X_PROFILE='secret')
+            self.client.get('/api/sku/?profile=secret')
+            out = io.StringIO()
+            call_command('profile_report', view='fulfil', stdout=out)
+        self.assertRegex(out.getvalue(), r'fulfil_order +2 ')
+        self.assertNotIn('SKUViewSet', out.getvalue())
+        self.assertIn('find_picks', out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, 'No profiles found'):
+            call_command(
+                'profile_report', directory=self.directory.name,
+                view='unknown', stdout=io.StringIO())
+
+
+@override_settings(QUERY_BUDGET={'STRICT': True})
+class QueryBudgetTestCase(APITestCase):
+
+    def synthetic_order(self, size):
+        """
+        Creates `size` SKUs stocked in two warehouses and returns an order
+        with a line for each.
+        """
+        self.north = Warehouse.objects.create(name='North')
+        self.south = Warehouse.objects.create(name='South')
+        skus = SKU.objects.bulk_create(
+            SKU(id=i, product_name='SKU %d' % i) for i in range(1, size + 1))
+        Storage.objects.bulk_create(
+            Storage(sku=sku, warehouse=warehouse, stock=3, aisle=i % 20,
+                    bay=i % 40)
+            for i, sku in enumerate(skus)
+            for warehouse in (self.north, self.south))
+        return [{'sku': sku.id, 'quantity': 5} for sku in skus]
+
+    @contextmanager
+    def assertWithinBudget(self, budget):
+        """
+        Fails if the block runs more than `budget` queries.
+        """
+        with override_settings(QUERY_BUDGET={'STRICT': True}):
+            with query_budget.within_budget(self.id(), budget):
+                yield
+
+    def test_fulfillment_budget(self):
+        """
+        Ensure fulfillment runs the same queries whatever the number of
+        lines.
+        """
+        lines = self.synthetic_order(300)
+        with self.assertWithinBudget(2):
+            response = self.client.post(
+                '/api/fulfillment/', {'lines': lines[:1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertWithinBudget(2):
+            self.client.post(
+                '/api/fulfillment/', {'lines': lines}, format='json')
+        # Lines are split across warehouses, located and routed
+        with self.assertWithinBudget(5):
+            response = self.client.post('/api/fulfillment/', {
+                'lines': lines, 'warehouse': self.north.id, 'route': True,
+                'partial': True}, format='json')
+        self.assertEqual(len(json.loads(response.content)['picks']), 600)
+
+    def test_list_budgets(self):
+        """
+        Ensure model API reads stay within their budgets on large tables.
+        """
+        lines = self.synthetic_order(50)
+        for url in ('/api/sku/', '/api/storage/?page_size=100',
+                    '/api/warehouse/', '/api/storage/?sku__in=%d,%d' % (
+                        lines[0]['sku'], lines[1]['sku']),
+                    '/api/sku/?ids=%d,%d' % (lines[0]['sku'], 999),
+                    '/api/sku/%d/' % lines[0]['sku']):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(
+            '/api/storage/multi-get/', {'ids': list(range(100))},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_strict(self):
+        """
+        Ensure violations raise in strict mode, showing the SQL.
+        """
+        @query_budget.query_budget(0)
+        def view(request):
+            return JsonResponse({'count': SKU.objects.count()})
+
+        with self.assertRaisesRegex(
+                query_budget.QueryBudgetExceeded,
+                r'view ran 1 queries, over its budget of 0:\n.*COUNT'):
+            view(RequestFactory().get('/'))
+
+    def test_log_and_count(self):
+        """
+        Ensure violations are logged and counted outside strict mode.
+        """
+        Order.objects.create(customer_name='Ada')
+        with override_settings(QUERY_BUDGET={'STRICT': False}):
+            with self.assertLogs('api.query_budget', 'WARNING') as logs:
+                with mock.patch.dict(
+                        views.OrderViewSet.query_budgets, {'list': 0}):
+                    response = self.client.get('/api/order/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('OrderViewSet.list ran 2 queries', logs.output[0])
+        response = self.client.get('/api/metrics/')
+        self.assertGreaterEqual(
+            json.loads(response.content)['query_budget_violations'][
+                'OrderViewSet.list'], 1)
+
+
+class PickRouteTestCase(APITestCase):
+
+    def test_s_shape(self):
+        """
+        Ensure aisles are walked front to back and back to front in turns,
+        with unlocated picks last.
+        """
+        picks = [{'id': i, 'quantity': 1} for i in range(1, 7)]
+        locations = {
+            1: ('A', 3, 2, 0), 2: ('A', 1, 5, 1), 3: ('A', 1, 5, 0),
+            4: ('A', 3, 9, 0), 5: ('A', 1, 1, None), 6: ('', None, None, 0),
+        }
+        route, method, length = routing.sequence_picks(picks, locations)
+        self.assertEqual([pick['id'] for pick in route], [5, 3, 2, 4, 1, 6])
+        self.assertEqual(method, routing.S_SHAPE)
+        # Up aisle 1, across the back (bay 10) and down aisle 3
+        self.assertEqual(length, 1 + 4 + 0 + (5 + 1) + 3 * 2 + 7)
+
+    def test_optimized_route(self):
+        """
+        Ensure larger plans are improved by 2-opt, with and without NumPy.
+        """
+        random.seed(42)
+        picks = [{'id': i, 'quantity': 1} for i in range(200)]
+        locations = {
+            i: ('', random.randint(1, 20), random.randint(1, 40), 0)
+            for i in range(200)}
+        with override_settings(PICK_ROUTE={'OPTIMIZE_MIN_PICKS': 10 ** 6}):
+            _, _, s_shape_length = routing.sequence_picks(picks, locations)
+        for np in (routing.np, None):
+            with mock.patch.object(routing, 'np', np), override_settings(
+                    PICK_ROUTE={'MAX_OPTIMIZE_SECONDS': 1}):
+                route, method, length = routing.sequence_picks(
+                    picks, locations)
+            self.assertEqual(method, routing.OPTIMIZED)
+            self.assertEqual(sorted(p['id'] for p in route), list(range(200)))
+            self.assertLess(length, s_shape_length)
+
+    def test_fulfillment_route(self):
+        """
+        Ensure fulfillment returns picks in route order on request.
+        """
+        skus = [SKU.objects.create(product_name=i) for i in range(3)]
+        storages = [
+            Storage.objects.create(sku=sku, stock=5, aisle=aisle, bay=bay)
+            for sku, aisle, bay in zip(skus, (2, 1, 2), (1, 4, 8))]
+        lines = [{'sku': sku.id, 'quantity': 1} for sku in skus]
+        response = self.client.post(
+            '/api/fulfillment/', {'lines': lines, 'route': True},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(response.content)
+        self.assertEqual(
+            [pick['id'] for pick in content['picks']],
+            [storages[1].id, storages[2].id, storages[0].id])
+        self.assertEqual(content['route']['method'], routing.S_SHAPE)
+
+        response = self.client.post(
+            '/api/fulfillment/', {'lines': lines, 'route': 'yes'},
+            format='json')
+        self.assertEqual(json.loads(response.content)['error']['code'], 16)
+
+
+class PartialFulfillmentTestCase(APITestCase):
+
+    def setUp(self):
+        self.skus = [SKU.objects.create(product_name=i) for i in range(3)]
+        self.storages = [
+            Storage.objects.create(sku=self.skus[i], stock=stock)
+            for i, stock in ((0, 5), (1, 2), (1, 3))]
+        self.lines = [
+            {'sku': self.skus[0].id, 'quantity': 4},
+            {'sku': self.skus[1].id, 'quantity': 8},
+            {'sku': self.skus[2].id, 'quantity': 1},
+        ]
+
+    def test_partial(self):
+        """
+        Ensure partial mode returns the feasible picks and what each line
+        is short of.
+        """
+        response = self.client.post('/api/fulfillment/', {
+            'lines': self.lines, 'partial': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(response.content)
+        self.assertFalse(content['complete'])
+        self.assertEqual(content['picks'], [
+            {'id': self.storages[0].id, 'quantity': 4},
+            {'id': self.storages[1].id, 'quantity': 2},
+            {'id': self.storages[2].id, 'quantity': 3},
+        ])
+        self.assertEqual(
+            [(line['picked'], line['backordered'])
+             for line in content['lines']],
+            [(4, 0), (5, 3), (0, 1)])
+
+        self.assertEqual(
+            find_picks(self.lines[:1], partial=True),
+            (True, [{'id': self.storages[0].id, 'quantity': 4}], [
+                {'sku': self.skus[0].id, 'quantity': 4, 'picked': 4,
+                 'backordered': 0}]))
+
+    def test_default_unchanged(self):
+        """
+        Ensure orders that can't be fulfilled in full still fail by default.
+        """
+        response = self.client.post(
+            '/api/fulfillment/', {'lines': self.lines}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content)['error']['code'], 11)
+
+        response = self.client.post('/api/fulfillment/', {
+            'lines': self.lines, 'partial': 1}, format='json')
+        self.assertEqual(json.loads(response.content)['error']['code'], 17)
+
+
+class IdempotencyKeyTestCase(APITestCase):
+
+    def setUp(self):
+        sku = SKU.objects.create(product_name='Test Product 123')
+        self.storage = Storage.objects.create(sku=sku, stock=5)
+        self.body = {'lines': [{'sku': sku.id, 'quantity': 2}]}
+
+    def post(self, body, key='order-1'):
+        return self.client.post(
+            '/api/fulfillment/', body, format='json',
+            HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay(self):
+        """
+        Ensure retries with the same key and body get the stored response
+        without planning again.
+        """
+        first = self.post(self.body)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        with mock.patch.object(views, 'find_picks') as find_picks:
+            retry = self.post(self.body)
+        find_picks.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_different_body(self):
+        """
+        Ensure a key can't be reused for a different request.
+        """
+        self.post(self.body)
+        self.body['lines'][0]['quantity'] = 3
+        response = self.post(self.body)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(json.loads(response.content)['error']['code'], 19)
+
+    def test_in_progress_and_errors(self):
+        """
+        Ensure concurrent retries are rejected and failed requests aren't
+        stored.
+        """
+        self.post(self.body)
+        # As if the first request was still running
+        IdempotencyKey.objects.update(status_code=None)
+        response = self.post(self.body)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(json.loads(response.content)['error']['code'], 20)
+
+        with mock.patch.object(views, 'find_picks', side_effect=KeyError):
+            response = self.post(self.body, key='order-2')
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(
+            IdempotencyKey.objects.filter(key='order-2').exists())
+        self.assertEqual(self.post(self.body, key='order-2').status_code, 200)
+
+    def test_reclaimed(self):
+        """
+        Ensure a request whose placeholder was reclaimed after LOCK_TIMEOUT
+        doesn't overwrite the new placeholder or fail.
+        """
+        def reclaim(*args, **kwargs):
+            IdempotencyKey.objects.all().delete()
+            IdempotencyKey.objects.create(key='order-1', request_hash='new')
+            return find_picks(*args, **kwargs)
+
+        with mock.patch.object(views, 'find_picks', side_effect=reclaim):
+            response = self.post(self.body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stored = IdempotencyKey.objects.get()
+        self.assertEqual(
+            (stored.request_hash, stored.status_code), ('new', None))
+
+        # Claims that keep racing with deletes give up
+        with mock.patch.object(
+                IdempotencyKey.objects, 'create', side_effect=IntegrityError):
+            response = self.post(self.body, key='order-2')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_not_pinned(self):
+        """
+        Ensure storing keys doesn't count as a write of the request.
+        """
+        self.body['lines'][0]['quantity'] = 6
+        response = self.post(self.body)
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(IdempotencyKey.objects.exists())
+        self.assertFalse(db_router._state.wrote)
+
+    def test_purge(self):
+        """
+        Ensure expired keys are reused and purged.
+        """
+        self.post(self.body)
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timezone.timedelta(days=2))
+        self.body['lines'][0]['quantity'] = 3
+        self.assertEqual(self.post(self.body).status_code, 200)
+        self.post(self.body, key='order-2')
+        IdempotencyKey.objects.filter(key='order-2').update(
+            created_at=timezone.now() - timezone.timedelta(days=2))
+        call_command(
+            'purge_idempotency_keys', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list('key', flat=True)),
+            ['order-1'])
+
+
+class OrderAggregatesTestCase(APITestCase):
+
+    def setUp(self):
+        self.skus = [SKU.objects.create(product_name=i) for i in range(3)]
+        self.orders = [
+            Order.objects.create(customer_name=name) for name in 'AB']
+
+    def aggregates(self, order):
+        return tuple(Order.all_objects.filter(id=order.id).values_list(
+            *Order.AGGREGATES).get())
+
+    def test_incremental(self):
+        """
+        Ensure aggregates follow lines created, updated, moved and deleted
+        through the API.
+        """
+        lines = []
+        for sku, quantity in ((0, 2), (0, 3), (1, 4)):
+            response = self.client.post('/api/orderline/', {
+                'order': self.orders[0].id, 'sku': self.skus[sku].id,
+                'quantity': quantity}, format='json')
+            lines.append(response.data['id'])
+        self.assertEqual(self.aggregates(self.orders[0]), (3, 9, 2))
+
+        self.client.patch(
+            '/api/orderline/%s/' % lines[0], {'quantity': 5}, format='json')
+        self.assertEqual(self.aggregates(self.orders[0]), (3, 12, 2))
+
+        self.client.patch(
+            '/api/orderline/%s/' % lines[2], {'order': self.orders[1].id},
+            format='json')
+        self.assertEqual(self.aggregates(self.orders[0]), (2, 8, 1))
+        self.assertEqual(self.aggregates(self.orders[1]), (1, 4, 1))
+
+        self.client.delete('/api/orderline/%s/' % lines[1])
+        OrderLine.objects.filter(id=lines[0]).delete()
+        self.assertEqual(self.aggregates(self.orders[0]), (0, 0, 0))
+
+        # Saving a stale order doesn't undo its aggregates
+        self.orders[1].customer_name = 'C'
+        self.orders[1].save()
+        self.assertEqual(self.aggregates(self.orders[1]), (1, 4, 1))
+
+    def test_stale_line(self):
+        """
+        Ensure saves of stale copies of a line apply their change against
+        the stored line, not the copy.
+        """
+        line = OrderLine.objects.create(
+            order=self.orders[0], sku=self.skus[0], quantity=2)
+        first = OrderLine.objects.get(id=line.id)
+        second = OrderLine.objects.get(id=line.id)
+        first.quantity = 5
+        first.save()
+        second.quantity = 7
+        second.save()
+        self.assertEqual(self.aggregates(self.orders[0]), (1, 7, 1))
+
+    def test_filter_and_sort(self):
+        """
+        Ensure orders can be filtered and sorted by aggregates.
+        """
+        for sku in self.skus:
+            OrderLine.objects.create(
+                order=self.orders[1], sku=sku, quantity=1)
+        response = self.client.get(
+            '/api/order/', {'distinct_skus__gte': 1, 'fields': 'id'})
+        self.assertEqual(
+            json.loads(response.content)['results'],
+            [{'id': self.orders[1].id}])
+        response = self.client.get(
+            '/api/order/', {'ordering': '-line_count', 'fields': 'id'})
+        self.assertEqual(
+            [order['id'] for order in json.loads(response.content)['results']],
+            [self.orders[1].id, self.orders[0].id])
+
+        # Ties are broken by id
+        third = Order.objects.create(customer_name='C')
+        response = self.client.get(
+            '/api/order/', {'ordering': 'line_count', 'fields': 'id'})
+        self.assertEqual(
+            [order['id'] for order in json.loads(response.content)['results']],
+            [self.orders[0].id, third.id, self.orders[1].id])
+
+    def test_rebuild(self):
+        """
+        Ensure aggregates of lines written in bulk can be rebuilt.
+        """
+        OrderLine.objects.bulk_create([
+            OrderLine(order=self.orders[0], sku=sku, quantity=2)
+            for sku in self.skus])
+        self.assertEqual(self.aggregates(self.orders[0]), (0, 0, 0))
+        call_command(
+            'rebuild_order_aggregates', chunk_size=1, stdout=io.StringIO())
+        self.assertEqual(self.aggregates(self.orders[0]), (3, 6, 3))
+        self.assertEqual(self.aggregates(self.orders[1]), (0, 0, 0))
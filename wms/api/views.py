@@ -1,20 +1,270 @@
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
 
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
+from rest_framework.fields import DateTimeField
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from django.views.decorators.csrf import csrf_exempt
 import json
+import math
+import time
 
-from .models import SKU, Storage, Order, OrderLine
+from .models import SKU, Storage, Order, OrderLine, Tombstone, Warehouse
 from .serializers import SKUSerializer, StorageSerializer, \
-    OrderSerializer, OrderLineSerializer
-from .helpers import error_response, is_ascii
+    OrderSerializer, OrderLineSerializer, ValuesSerializer, \
+    WarehouseSerializer
+from .filters import QueryParamFilterBackend, StableOrderingFilter
+from .helpers import error_response, is_ascii, is_true, convert_to_ascii
 from .find_picks import find_picks
+from .search import search_orders, search_settings
+from .routing import sequence_picks
+from .admission import admission_controlled, get_controller
+from .idempotency import idempotent
+from .profiling import ProfiledMixin, profiled
+from .query_budget import QueryBudgetMixin, query_budget, violations
+from .db_router import ReplicaReadMixin, reads_from_replica, replica_reads
+from .changes import change_feed_settings, feed
 
 # Viewsets (for Django REST framework)
 
 
-class SKUViewSet(viewsets.ModelViewSet):
+class SparseFieldsMixin(object):
+    """
+    Lets GET requests select a subset of the serializer's fields with a
+    `fields` query parameter (e.g. `?fields=id,stock`). Unselected columns
+    are deferred in SQL and dropped from the serializer.
+    """
+    # Actions other than GETs that read and accept `fields` too
+    sparse_fields_actions = ()
+
+    def get_requested_fields(self):
+        """
+        Returns the requested fields in serializer order, or None if all
+        fields are wanted.
+        """
+        value = self.request.query_params.get('fields', None)
+        if value is None or (self.request.method != 'GET' and
+                             self.action not in self.sparse_fields_actions):
+            return None
+        allowed = self.get_serializer_class().Meta.fields
+        requested = [f for f in value.split(',') if f]
+        unknown = [f for f in requested if f not in allowed]
+        if unknown or not requested:
+            raise ValidationError({'fields': [
+                "Must be a comma separated list of %s. %s found." % (
+                    ', '.join(allowed), value)]})
+        return tuple(f for f in allowed if f in requested)
+
+    def filter_queryset(self, queryset):
+        queryset = super(SparseFieldsMixin, self).filter_queryset(queryset)
+        fields = self.get_requested_fields()
+        if fields is not None:
+            queryset = queryset.only(*fields)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(SparseFieldsMixin, self).get_serializer(
+            *args, **kwargs)
+        fields = self.get_requested_fields()
+        if fields is not None:
+            target = getattr(serializer, 'child', serializer)
+            for name in set(target.fields) - set(fields):
+                target.fields.pop(name)
+        return serializer
+
+
+class FastListMixin(SparseFieldsMixin):
+    """
+    Serves the list action from `values_list()` rows rendered by a
+    ValuesSerializer, fetching only the requested fields. Other actions
+    keep the full serializer.
+    """
+    fast_list = True
+
+    def list(self, request, *args, **kwargs):
+        if not self.fast_list:
+            return super(FastListMixin, self).list(request, *args, **kwargs)
+
+        serializer = ValuesSerializer(
+            self.get_serializer_class(), self.get_requested_fields())
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
+
+
+class DeltaSyncMixin(object):
+    """
+    Turns the list action into a delta sync when an `updated_since` query
+    parameter is given: rows updated since then, in keyset order on
+    (updated_at, id), plus the ids of rows deleted since then.
+
+    Each page returns a `cursor` ({'updated_since', 'after_id'}) and a
+    `next` link built from it; a sync is complete when `next` is null, and
+    the last cursor starts the next sync. Deleted ids may be repeated
+    across pages and syncs.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if 'updated_since' not in request.query_params:
+            return super(DeltaSyncMixin, self).list(request, *args, **kwargs)
+
+        since, after_id = self.get_sync_cursor()
+        queryset = self.filter_queryset(self.get_queryset())
+        if after_id is None:
+            queryset = queryset.filter(updated_at__gte=since)
+        else:
+            queryset = queryset.filter(
+                Q(updated_at__gt=since) | Q(updated_at=since, id__gt=after_id))
+        queryset = queryset.order_by('updated_at', 'id')
+
+        fields = self.get_requested_fields() or \
+            self.get_serializer_class().Meta.fields
+        fields = ('id',) + tuple(
+            f for f in fields if f not in ('id', 'updated_at')) + \
+            ('updated_at',)
+        serializer = ValuesSerializer(self.get_serializer_class(), fields)
+
+        page_size = self.paginator.get_page_size(request)
+        rows = list(serializer.values(queryset)[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        if rows:
+            after_id, cursor_since = rows[-1][0], rows[-1][-1]
+        else:
+            cursor_since = since
+
+        # Deletions in the same time window as the rows of this page
+        tombstones = Tombstone.objects.filter(
+            model=queryset.model._meta.model_name, deleted_at__gte=since)
+        if has_next:
+            tombstones = tombstones.filter(deleted_at__lte=cursor_since)
+
+        cursor = {
+            'updated_since': DateTimeField().to_representation(cursor_since),
+            'after_id': after_id,
+        }
+        next_url = None
+        if has_next:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'updated_since',
+                cursor['updated_since'])
+            next_url = replace_query_param(next_url, 'after_id', after_id)
+
+        return Response({
+            'next': next_url,
+            'cursor': cursor,
+            'results': serializer.to_representation(rows),
+            'deleted': sorted(set(
+                tombstones.values_list('object_id', flat=True))),
+        })
+
+    def get_sync_cursor(self):
+        """
+        Returns the validated `updated_since` datetime and `after_id`.
+        """
+        params = self.request.query_params
+        errors = {}
+        since = None
+        try:
+            since = parse_datetime(params['updated_since'])
+        except ValueError:
+            pass
+        if since is None:
+            errors['updated_since'] = [
+                "Must be an ISO 8601 datetime. %s found."
+                % params['updated_since']]
+        elif timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.utc)
+
+        after_id = params.get('after_id', None)
+        if after_id is not None:
+            try:
+                after_id = int(after_id)
+            except ValueError:
+                errors['after_id'] = [
+                    "Must be a valid id (int). %s found." % after_id]
+        if errors:
+            raise ValidationError(errors)
+        return since, after_id
+
+
+class SoftDeleteMixin(object):
+    """
+    Soft-deletes rows on DELETE, so that rows still referenced by others
+    can be deleted and delta syncs see the deletion.
+    """
+
+    def perform_destroy(self, instance):
+        instance.soft_delete()
+
+
+class MultiGetMixin(object):
+    """
+    Fetches many rows by id in one query: `?ids=1,2,3` on the list action,
+    or a POST of `{"ids": [1, 2, 3]}` to `multi-get/` for long lists. Rows
+    are returned in request order, along with the ids that weren't found.
+    """
+    max_ids = 1000
+    sparse_fields_actions = ('multi_get',)
+
+    def list(self, request, *args, **kwargs):
+        value = request.query_params.get('ids', None)
+        if value is None:
+            return super(MultiGetMixin, self).list(request, *args, **kwargs)
+        return self.multi_get_response(
+            self.parse_ids([v for v in value.split(',') if v], value))
+
+    @action(detail=False, methods=['post'], url_path='multi-get')
+    def multi_get(self, request, *args, **kwargs):
+        ids = request.data.get('ids') if isinstance(request.data, dict) \
+            else None
+        if not isinstance(ids, list):
+            raise ValidationError({'ids': ["Must be a list of ids."]})
+        with replica_reads(request):
+            return self.multi_get_response(self.parse_ids(ids, ids))
+
+    def parse_ids(self, values, raw):
+        """
+        Returns the requested ids, without duplicates.
+        """
+        try:
+            ids = [int(v) for v in values]
+        except (TypeError, ValueError):
+            ids = None
+        if not ids or min(ids) < 0 or len(ids) > self.max_ids:
+            raise ValidationError({'ids': [
+                "Must be a list of 1 to %d positive ints. %s found." % (
+                    self.max_ids, raw)]})
+        return list(dict.fromkeys(ids))
+
+    def multi_get_response(self, ids):
+        serializer = ValuesSerializer(
+            self.get_serializer_class(), self.get_requested_fields())
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = {
+            row[0]: row[1:] for row in queryset.filter(id__in=ids)
+            .order_by().values_list('id', *serializer.columns)}
+        return Response({
+            'results': serializer.to_representation(
+                rows[i] for i in ids if i in rows),
+            'missing': [i for i in ids if i not in rows],
+        })
+
+
+class SKUViewSet(ProfiledMixin, QueryBudgetMixin, ReplicaReadMixin,
+                 MultiGetMixin, DeltaSyncMixin, SoftDeleteMixin, FastListMixin,
+                 viewsets.ModelViewSet):
     """
     API endpoint that allows SKUs to be viewed or edited.
     """
@@ -23,31 +273,63 @@ class SKUViewSet(viewsets.ModelViewSet):
     serializer_class = SKUSerializer
 
 
-class StorageViewSet(viewsets.ModelViewSet):
+class WarehouseViewSet(ProfiledMixin, QueryBudgetMixin, ReplicaReadMixin,
+                       MultiGetMixin, DeltaSyncMixin, SoftDeleteMixin,
+                       FastListMixin, viewsets.ModelViewSet):
+    """
+    API endpoint that allows Warehouses to be viewed or edited.
+    """
+    permission_classes = (AllowAny,)
+    queryset = Warehouse.objects.get_queryset().order_by('id')
+    serializer_class = WarehouseSerializer
+
+
+class StorageViewSet(ProfiledMixin, QueryBudgetMixin, ReplicaReadMixin,
+                     MultiGetMixin, DeltaSyncMixin, SoftDeleteMixin,
+                     FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Storages to be viewed or edited.
     """
     permission_classes = (AllowAny,)
     queryset = Storage.objects.get_queryset().order_by('id')
     serializer_class = StorageSerializer
+    filter_backends = (QueryParamFilterBackend,)
+    filter_fields = (
+        'sku', 'sku__in', 'stock', 'stock__gt', 'stock__gte', 'stock__lt',
+        'stock__lte', 'warehouse', 'warehouse__in')
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ProfiledMixin, QueryBudgetMixin, ReplicaReadMixin,
+                   MultiGetMixin, DeltaSyncMixin, SoftDeleteMixin,
+                   FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Orders to be viewed or edited.
     """
     permission_classes = (AllowAny,)
     queryset = Order.objects.get_queryset().order_by('id')
     serializer_class = OrderSerializer
+    filter_backends = (QueryParamFilterBackend, StableOrderingFilter)
+    filter_fields = tuple(
+        '%s%s' % (field, lookup) for field in Order.AGGREGATES
+        for lookup in ('', '__gt', '__gte', '__lt', '__lte'))
+    ordering_fields = ('id',) + Order.AGGREGATES
+    query_budgets = dict(QueryBudgetMixin.query_budgets, search=3)
 
     def get_queryset(self):
         """
         Filter by `customer_name` against a `q` query parameter.
+
+        With `fold=true` the query is folded to ASCII as well, so that
+        accented queries also match unaccented names.
         """
         queryset = Order.objects.get_queryset().order_by('id')
         customer_name = self.request.query_params.get('q', None)
         if customer_name is not None:
-            if not is_ascii(customer_name):
+            if is_true(self.request.query_params.get('fold', False)):
+                queryset = queryset.filter(
+                    customer_name_ascii__icontains=convert_to_ascii(
+                        customer_name))
+            elif not is_ascii(customer_name):
                 queryset = queryset.filter(
                     customer_name__icontains=customer_name)
             else:
@@ -55,22 +337,66 @@ class OrderViewSet(viewsets.ModelViewSet):
                     customer_name_ascii__icontains=customer_name)
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def search(self, request, *args, **kwargs):
+        """
+        Ranked type-ahead search: the top `k` orders whose folded customer
+        name matches `q` (see `search_orders()`), without a count.
+        """
+        config = search_settings()
+        value = request.query_params.get('k', config['DEFAULT_LIMIT'])
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= config['MAX_LIMIT']:
+            raise ValidationError({'k': [
+                "Must be an int from 1 to %d. %s found." % (
+                    config['MAX_LIMIT'], value)]})
+
+        fields = self.get_requested_fields() or \
+            self.get_serializer_class().Meta.fields
+        fields = ('id',) + tuple(f for f in fields if f != 'id')
+        serializer = ValuesSerializer(self.get_serializer_class(), fields)
+        with replica_reads(request):
+            results = search_orders(
+                request.query_params.get('q', ''), limit, serializer.columns)
+        rows = serializer.to_representation(row for _, row in results)
+        for row, (match, _) in zip(rows, results):
+            row['match'] = match
+        response = Response({'results': rows})
+        # Lets type-ahead clients reuse answers as the user edits a query
+        response['Cache-Control'] = 'private, max-age=%d' % config['MAX_AGE']
+        return response
+
 
-class OrderLineViewSet(viewsets.ModelViewSet):
+class OrderLineViewSet(ProfiledMixin, QueryBudgetMixin, ReplicaReadMixin,
+                       MultiGetMixin, DeltaSyncMixin, SoftDeleteMixin,
+                       FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows OrderLines to be viewed or edited.
     """
     permission_classes = (AllowAny,)
     queryset = OrderLine.objects.get_queryset().order_by('id')
     serializer_class = OrderLineSerializer
+    filter_backends = (QueryParamFilterBackend,)
+    filter_fields = ('order', 'order__in', 'sku', 'sku__in')
 
 # Fulfillment
 
 @csrf_exempt
+@idempotent
+@admission_controlled
+@profiled
+@query_budget(5)
+@reads_from_replica
 def fulfil_order(request):
     """
     API endpoint returns instruction for fulfilling an order
     as an ordered list of picks.
+
+    Runs at most 5 queries whatever the number of lines: SKUs, preferred
+    warehouse, its stock, stock across warehouses and pick locations.
     """
     try:
         # validate request method
@@ -137,25 +463,137 @@ def fulfil_order(request):
                         "Field %s must be a valid id (positive int). \
                             %s found." % (field, line[field]))
 
-            # validate the referenced SKUs exist
-            sku_id = int(line['sku'])
-            try:
-                sku = SKU.objects.get(id=sku_id)
-            except SKU.DoesNotExist:
-                return error_response(400, 10, 
+        # validate the referenced SKUs exist, in one query
+        sku_ids = [int(line['sku']) for line in order_lines]
+        existing = set(SKU.objects.filter(id__in=set(sku_ids)).values_list(
+            'id', flat=True))
+        for sku_id in sku_ids:
+            if sku_id not in existing:
+                return error_response(400, 10,
                     "Referenced SKU with id %s does not exist" % sku_id)
+
+        # validate the optional preferred warehouse
+        warehouse = params.get('warehouse', None)
+        if warehouse is not None:
+            try:
+                warehouse = int(warehouse)
+            except (TypeError, ValueError):
+                return error_response(400, 8,
+                    "Field warehouse must be a valid id (int). %s found."
+                        % type(warehouse))
+            if not Warehouse.objects.filter(id=warehouse).exists():
+                return error_response(400, 15,
+                    "Referenced Warehouse with id %s does not exist"
+                        % warehouse)
+
+        # validate the optional route flag
+        route = params.get('route', False)
+        if not isinstance(route, bool):
+            return error_response(400, 16,
+                "Parameter route must be a boolean. %s found." % type(route))
+
+        # validate the optional partial flag
+        partial = params.get('partial', False)
+        if not isinstance(partial, bool):
+            return error_response(400, 17,
+                "Parameter partial must be a boolean. %s found."
+                    % type(partial))
     except Exception as e:
         return error_response(500, 98, "Internal server error: %s" % e)
 
     # Generate picks
     try:
-        success, picks = find_picks(order_lines)
-        if not success:
-            return error_response(
-                    400, 11, "Order cannot be fulfilled.")
+        response = {'success': True}
+        if partial:
+            complete, picks, lines = find_picks(
+                order_lines, warehouse, partial=True)
+            response.update({'complete': complete, 'lines': lines})
         else:
-            return JsonResponse({'success': True, 'picks': picks}, status=200)
+            success, picks = find_picks(order_lines, warehouse)
+            if not success:
+                return error_response(
+                        400, 11, "Order cannot be fulfilled.")
+        if route:
+            locations = {
+                row[0]: row[1:] for row in Storage.objects.filter(
+                    id__in={pick['id'] for pick in picks}).values_list(
+                        'id', 'zone', 'aisle', 'bay', 'level')}
+            picks, method, length = sequence_picks(picks, locations)
+            response['route'] = {'method': method, 'length': length}
+        response['picks'] = picks
+        return JsonResponse(response, status=200)
     except Exception as e:
         return error_response(500, 99, "Internal server error: %s" % e)
 
     return JsonResponse(picks, status_code=200)
+
+
+# Change feed
+
+@require_GET
+def change_feed(request):
+    """
+    API endpoint returns changes to SKUs and Storages, as a server-sent
+    events stream if the client accepts `text/event-stream` and as a JSON
+    long-poll otherwise.
+
+    Changes after the cursor in the `Last-Event-ID` header or `cursor`
+    query parameter are returned (only new changes without a cursor). The
+    long-poll waits up to `wait` seconds for a change.
+    """
+    config = change_feed_settings()
+    cursor = request.META.get(
+        'HTTP_LAST_EVENT_ID', request.GET.get('cursor', None))
+
+    if 'text/event-stream' not in request.META.get('HTTP_ACCEPT', ''):
+        try:
+            wait = float(request.GET.get('wait', 25))
+            # NaN would never compare below the limit and wait forever
+            if not math.isfinite(wait):
+                raise ValueError(wait)
+        except ValueError:
+            return error_response(
+                400, 14, "Parameter wait must be a number of seconds.")
+        wait = min(wait, config['MAX_WAIT'])
+        events, cursor, reset = feed.read(cursor, max(wait, 0))
+        return JsonResponse(
+            {'events': events, 'cursor': cursor, 'reset': reset})
+
+    def stream(cursor):
+        # Streams end after a while so workers are freed; clients
+        # reconnect with the last event id
+        deadline = time.monotonic() + config['MAX_STREAM_SECONDS']
+        yield 'retry: 1000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            events, cursor, reset = feed.read(
+                cursor, min(config['HEARTBEAT'], remaining))
+            if reset:
+                yield 'id: %s\nevent: reset\ndata: {}\n\n' % cursor
+            for event in events:
+                yield 'id: %s\nevent: change\ndata: %s\n\n' % (
+                    feed.cursor(event['seq']), json.dumps(event))
+            if not events and not reset:
+                yield ': keepalive\n\n'
+
+    response = StreamingHttpResponse(
+        stream(cursor), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Metrics
+
+def metrics(request):
+    """
+    API endpoint returns operational metrics of this worker process.
+    """
+    controller = get_controller()
+    return JsonResponse({
+        'fulfillment_admission':
+            controller.stats() if controller is not None else None,
+        'query_budget_violations': violations(),
+    })
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'api.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,6 +84,24 @@ DATABASES = {
     }
 }
 
+# Read replicas: aliases in DATABASES that serve viewset list/retrieve and
+# fulfillment reads. Writes always go to `default`, and a client that wrote
+# reads from `default` for READ_YOUR_WRITES_SECONDS afterwards (tracked in
+# the cache, which must be shared between workers in production).
+#
+# Set WMS_REPLICA_DB to the path of a second SQLite file (a copy of
+# db.sqlite3) to try this locally.
+
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter']
+
+if os.environ.get('WMS_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['WMS_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS = ['replica']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -121,12 +141,84 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Application settings
+# Each feature reads its settings in its module, which holds the defaults;
+# the settings below only override them.
+#
+# COMPRESSION_MIN_SIZE (api/middleware.py): smaller responses, in bytes,
+# aren't compressed. Brotli and zstd are used when installed.
+#
+# FULFILLMENT_ADMISSION (api/admission.py), per worker process: at most
+# MAX_CONCURRENT requests run at once, up to MAX_QUEUE more wait
+# (MAX_QUEUE_PER_CLIENT per client) for at most MAX_WAIT seconds. Set to
+# None to disable.
+#
+# CHANGE_FEED (api/changes.py): changes to SKUs and storages are buffered
+# in each worker process, and the last BUFFER_SIZE can be resumed. Event
+# streams send a keepalive every HEARTBEAT seconds and close after
+# MAX_STREAM_SECONDS; long-polls wait at most MAX_WAIT seconds.
+#
+# IDEMPOTENCY (api/idempotency.py): fulfillment responses to requests with
+# an Idempotency-Key header are replayed to retries for TTL seconds; a
+# request that hasn't answered after LOCK_TIMEOUT seconds is presumed dead
+# and its key can be used again.
+#
+# PICK_ROUTE (api/routing.py): walking distances are AISLE_WIDTH per aisle
+# crossed and BAY_WIDTH per bay. Plans with OPTIMIZE_MIN_PICKS or more
+# picks in a zone are improved by nearest neighbour + 2-opt for at most
+# MAX_OPTIMIZE_SECONDS.
+#
+# QUERY_BUDGET (api/query_budget.py): views declare the most queries a
+# request may run. Violations raise in STRICT mode (with DEBUG on, and in
+# test runs through TEST_RUNNER); otherwise they are logged with their SQL
+# and counted at /api/metrics/.
+#
+# ORDER_SEARCH (api/search.py): ranked type-ahead search at
+# /api/order/search/ ignores queries shorter than MIN_LENGTH and only looks
+# for substrings from SUBSTRING_MIN_LENGTH characters. Clients may cache
+# answers for MAX_AGE seconds.
+
+# Stock snapshot (api/snapshot.py)
+# When PATH is set, fulfillment plans from the snapshot file written by
+# `manage.py build_stock_snapshot`, checking it for a new version every
+# CHECK_INTERVAL seconds, plus the storages saved since it was built (less
+# OVERLAY_MARGIN seconds for clock skew). Snapshots older than MAX_AGE
+# seconds are ignored.
+
+STOCK_SNAPSHOT = {
+    'PATH': os.environ.get('WMS_STOCK_SNAPSHOT'),
+}
+
+# Profiling (api/profiling.py)
+# When DIRECTORY is set, a SAMPLE_RATE share of fulfillment and viewset
+# requests run under cProfile, plus requests sending TOKEN, if set, in an
+# X-Profile header or `profile` query parameter. The newest MAX_FILES
+# profiles are kept; see `manage.py profile_report`.
+
+PROFILING = {
+    'DIRECTORY': os.environ.get('WMS_PROFILE_DIR'),
+}
+
+TEST_RUNNER = 'wms.test_runner.TestRunner'
+
 # Rest framework
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
+        'api.renderers.ColumnarJSONRenderer',
+    )
+}
+
+# MessagePack responses are available when msgpack is installed
+
+try:
+    import msgpack  # noqa: F401
+except ImportError:
+    pass
+else:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] += (
+        'api.renderers.MessagePackRenderer',
     )
-}
\ No newline at end of file
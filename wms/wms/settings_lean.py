@@ -0,0 +1,58 @@
+"""
+Lean settings profile for API-only nodes.
+
+Select it with DJANGO_SETTINGS_MODULE=wms.settings_lean (or
+`manage.py --settings=wms.settings_lean`). It extends the default settings
+but drops the apps and middleware that only serve the admin, sessions and
+browser forms: the API is AllowAny, has no login and `fulfil_order` is
+csrf_exempt. Fewer apps make startup faster and fewer middleware make
+every request cheaper.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK
+
+
+LEAN_DROPPED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)
+
+LEAN_DROPPED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+)
+
+INSTALLED_APPS = [
+    app for app in INSTALLED_APPS if app not in LEAN_DROPPED_APPS]
+
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if middleware not in LEAN_DROPPED_MIDDLEWARE]
+
+# Only JSON and friends are rendered, so no templates are needed
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
+
+USE_L10N = False
+
+# Without django.contrib.auth, DRF must not authenticate requests or fall
+# back to AnonymousUser
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,
+    DEFAULT_AUTHENTICATION_CLASSES=(),
+    DEFAULT_PERMISSION_CLASSES=(
+        'rest_framework.permissions.AllowAny',
+    ),
+    UNAUTHENTICATED_USER=None,
+)
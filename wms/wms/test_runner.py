@@ -0,0 +1,24 @@
+"""
+Test runner for wms.
+
+Select it with the TEST_RUNNER setting. It runs the suite with query
+budgets in strict mode, so that a view over its budget fails the test
+that ran it instead of only being logged.
+"""
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self.strict_budgets = override_settings(QUERY_BUDGET=dict(
+            getattr(settings, 'QUERY_BUDGET', {}), STRICT=True))
+        self.strict_budgets.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.strict_budgets.disable()
+        super(TestRunner, self).teardown_test_environment(**kwargs)
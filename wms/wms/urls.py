@@ -13,7 +13,6 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 
@@ -22,6 +21,7 @@ from api import views
 
 router = routers.DefaultRouter()
 router.register(r'sku', views.SKUViewSet)
+router.register(r'warehouse', views.WarehouseViewSet)
 router.register(r'storage', views.StorageViewSet)
 router.register(r'order', views.OrderViewSet)
 router.register(r'orderline', views.OrderLineViewSet)
@@ -29,4 +29,6 @@ router.register(r'orderline', views.OrderLineViewSet)
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/fulfillment/', views.fulfil_order),
+    path('api/changes/', views.change_feed),
+    path('api/metrics/', views.metrics),
 ]